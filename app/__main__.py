@@ -0,0 +1,49 @@
+import glob
+import os
+import shutil
+import tempfile
+
+import uvicorn
+
+from app.core.config import settings
+
+def _prepare_metrics_dir():
+    """
+    Give the workers a shared, empty directory to write their Prometheus
+    metrics to. Returns the directory if it was created here.
+    """
+    directory = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    created = None
+    if not directory:
+        directory = created = tempfile.mkdtemp(prefix="omni-metrics-")
+    os.makedirs(directory, exist_ok=True)
+    # Files left by a previous run would be counted as live workers
+    for stale in glob.glob(os.path.join(directory, "*.db")):
+        os.remove(stale)
+    # Read by prometheus_client when each worker imports it
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = directory
+    return created
+
+def main():
+    """
+    Serve the API with WORKERS processes.
+
+    Only the settings are imported here, so the supervising process never
+    builds the app, loads the model or claims a CPU slot; each server
+    process imports app.main itself.
+    """
+    created = _prepare_metrics_dir() if settings.WORKERS > 1 else None
+    try:
+        uvicorn.run(
+            "app.main:app",
+            host=settings.HOST,
+            port=settings.PORT,
+            reload=settings.DEBUG,
+            workers=settings.WORKERS
+        )
+    finally:
+        if created:
+            shutil.rmtree(created, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
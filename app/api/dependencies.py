@@ -1,8 +1,16 @@
-from fastapi import Header, HTTPException, status
-from typing import Optional
+from fastapi import Header, HTTPException, Query, Request, status
+from typing import List, Optional
+import math
 
 from app.core.config import settings
-from app.core.security import verify_token
+from app.core.security import decode_token, verify_token
+from app.services.model_service import DetectionFilter, model_service
+from app.services.profiling_service import profiling_service
+from app.services.rate_limiter import rate_limiter
+from app.services.scheduler import PRIORITY_CLASSES
+from app.utils.deadline import Deadline
+from app.utils.logger import logger
+from app.utils.tracing import set_current_trace
 
 async def get_token_header(x_token: str = Header(...)):
     """Verify API token"""
@@ -12,6 +20,91 @@ async def get_token_header(x_token: str = Header(...)):
             detail="Invalid authentication credentials"
         )
 
+async def get_admin_token_header(x_token: str = Header(...)):
+    """Verify API token belongs to an administrator"""
+    payload = decode_token(x_token)
+    if payload is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid authentication credentials"
+        )
+    if payload.get("sub") not in settings.ADMIN_SUBJECTS:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Administrator privileges required"
+        )
+
+async def limit_request(x_token: str = Header(...)):
+    """Hold one of the token subject's rate and concurrency slots until the response is sent"""
+    if not rate_limiter.enabled:
+        yield
+        return
+    subject = str((decode_token(x_token) or {}).get("sub", "anonymous"))
+    rejected = rate_limiter.acquire(subject)
+    if rejected is not None:
+        reason, retry_after = rejected
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many concurrent requests" if reason == "concurrency" else "Rate limit exceeded",
+            headers={"Retry-After": str(max(math.ceil(retry_after), 1))}
+        )
+    try:
+        yield
+    finally:
+        rate_limiter.release(subject)
+
+def priority_for(default: str):
+    """Build a dependency resolving a request's priority class.
+
+    The route supplies the default; a "priority" claim in the token overrides it.
+    """
+    async def get_priority(x_token: str = Header(...)) -> str:
+        claim = (decode_token(x_token) or {}).get("priority")
+        return claim if claim in PRIORITY_CLASSES else default
+    return get_priority
+
+async def get_deadline(
+    x_request_timeout: Optional[float] = Header(None, gt=0, description="Seconds the client will wait")
+) -> Deadline:
+    """Build the deadline after which the request's work is dropped"""
+    return Deadline(x_request_timeout or settings.REQUEST_DEADLINE_SECONDS)
+
+async def get_detection_filter(
+    labels: Optional[List[str]] = Query(None, description="Only return these labels (repeat or comma-separate)"),
+    top_k: Optional[int] = Query(None, ge=1, description="Return at most this many boxes per image, highest scores first"),
+    min_box_area: Optional[float] = Query(None, ge=0, description="Drop boxes smaller than this many square pixels")
+) -> Optional[DetectionFilter]:
+    """Build the per-image result filter from query parameters"""
+    if labels is None and top_k is None and min_box_area is None:
+        return None
+    label_ids = None
+    if labels is not None:
+        names = [name.strip() for value in labels for name in value.split(",") if name.strip()]
+        try:
+            label_ids = model_service.label_ids(names)
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return DetectionFilter(label_ids, top_k, min_box_area)
+
+async def trace_request(request: Request):
+    """Trace the request's stages, log them and count the request towards profiling sessions"""
+    trace = profiling_service.start_trace(request.url.path)
+    set_current_trace(trace)
+    try:
+        yield
+    finally:
+        profiling_service.request_finished(trace)
+        logger.info(
+            "Request completed",
+            extra={
+                "high_volume": True,
+                "request_id": trace.request_id,
+                "route": trace.route,
+                "duration_ms": trace.elapsed_ms(),
+                "stages": trace.stage_durations()
+            }
+        )
+
 async def get_query_token(token: str):
     """Verify query token (alternative authentication)"""
     if token != settings.SECRET_KEY:
@@ -0,0 +1,80 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from typing import Optional
+import asyncio
+
+from app.models.schemas import NearDuplicateStatusResponse, ProfilingStatusResponse
+from app.api.dependencies import get_admin_token_header
+from app.services.near_duplicate_service import near_duplicate_cache
+from app.services.profiling_service import profiling_service
+
+router = APIRouter(
+    prefix="/admin",
+    tags=["admin"],
+    dependencies=[Depends(get_admin_token_header)],
+    responses={401: {"description": "Unauthorized"}, 403: {"description": "Forbidden"}}
+)
+
+@router.get("/profiling", response_model=ProfilingStatusResponse)
+async def profiling_status():
+    """
+    Show the current or last profiling session.
+    """
+    return profiling_service.status()
+
+@router.post("/profiling/start", response_model=ProfilingStatusResponse)
+async def start_profiling(
+    requests: Optional[int] = Query(None, ge=1, description="Stop after this many detection requests"),
+    seconds: Optional[float] = Query(None, gt=0, description="Stop after this many seconds")
+):
+    """
+    Start torch.profiler and the Python sampling profiler.
+
+    - **requests**: Number of detection requests to profile
+    - **seconds**: Maximum session duration (capped by PROFILE_MAX_SECONDS)
+    """
+    try:
+        return profiling_service.start(max_requests=requests, seconds=seconds)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@router.post("/profiling/stop", response_model=ProfilingStatusResponse)
+async def stop_profiling():
+    """
+    Stop the running session and write Chrome-trace and flamegraph files.
+    """
+    return await asyncio.to_thread(profiling_service.stop)
+
+@router.put("/profiling/traces", response_model=ProfilingStatusResponse)
+async def set_trace_sample_rate(
+    sample_rate: float = Query(..., ge=0.0, le=1.0, description="Fraction of requests to trace")
+):
+    """
+    Set the fraction of detection requests recorded as per-stage traces.
+    """
+    profiling_service.trace_sample_rate = sample_rate
+    return profiling_service.status()
+
+@router.get("/near-duplicates", response_model=NearDuplicateStatusResponse)
+async def near_duplicate_status():
+    """
+    Show near-duplicate cache size, hit rate and distance threshold.
+    """
+    return near_duplicate_cache.stats()
+
+@router.put("/near-duplicates", response_model=NearDuplicateStatusResponse)
+async def set_near_duplicate_distance(
+    max_distance: int = Query(..., ge=0, le=64, description="Largest hash distance treated as a duplicate")
+):
+    """
+    Set the perceptual hash distance threshold for reusing detections.
+    """
+    near_duplicate_cache.set_max_distance(max_distance)
+    return near_duplicate_cache.stats()
+
+@router.delete("/near-duplicates", response_model=NearDuplicateStatusResponse)
+async def clear_near_duplicates():
+    """
+    Drop every cached result, e.g. after a model change.
+    """
+    near_duplicate_cache.clear()
+    return near_duplicate_cache.stats()
@@ -1,32 +1,103 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Query
-from fastapi.responses import JSONResponse
-from typing import Optional
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+from typing import Any, AsyncIterator, Awaitable, Dict, List, Optional, Tuple, Type, TypeVar, Union
+import asyncio
 
+from app.services.crop_service import CROP_FORMATS, crop_service
 from app.services.detection_service import DetectionService
-from app.models.schemas import DetectionResponse, ErrorResponse, DetectionRequest
-from app.api.dependencies import get_token_header
+from app.services.file_ingest_service import file_ingest_service
+from app.services.memory_budget import memory_budget
+from app.services.model_service import DetectionFilter
+from app.services.scheduler import inference_scheduler
+from app.models.schemas import (
+    DetectionResponse, ErrorResponse, DetectionRequest, FileDetectionRequest, FileDetectionResponse
+)
+from app.api.dependencies import (
+    get_deadline, get_detection_filter, get_token_header, limit_request, priority_for, trace_request
+)
+from app.core.config import settings
+from app.utils.deadline import Deadline, DeadlineExceeded, RequestCancelled
+from app.utils.image_processor import image_processor
+from app.utils.logger import logger
+from app.utils.metrics import timed_stage
+from app.utils.serialization import FastJSONResponse, MSGPACK_MEDIA_TYPES, dumps_json, negotiated_response
 
 router = APIRouter(
     prefix="/detect",
     tags=["detection"],
-    dependencies=[Depends(get_token_header)],
-    responses={401: {"description": "Unauthorized"}}
+    dependencies=[Depends(get_token_header), Depends(trace_request), Depends(limit_request)],
+    default_response_class=FastJSONResponse,
+    responses={401: {"description": "Unauthorized"}, 429: {"description": "Client rate or concurrency limit reached"}}
 )
 
+# Non-standard status used when the client closed the connection before the response
+CLIENT_CLOSED_REQUEST = 499
+
+T = TypeVar("T")
+
+async def _run_while_connected(request: Request, deadline: Deadline, work: Awaitable[T]) -> T:
+    """Await detection work, abandoning it if the client disconnects"""
+    task = asyncio.ensure_future(work)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=settings.DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                deadline.cancel()
+                task.cancel()
+                raise RequestCancelled("Client disconnected")
+    finally:
+        if not task.done():
+            task.cancel()
+
+def _cancelled_response(e: RequestCancelled) -> Response:
+    """Map dropped work to a response"""
+    if isinstance(e, DeadlineExceeded):
+        return JSONResponse(status_code=504, content={"detail": str(e)})
+    return Response(status_code=CLIENT_CLOSED_REQUEST)
+
+# Documents the MessagePack alternative to a route's JSON body
+MSGPACK_CONTENT = {"content": {media_type: {} for media_type in MSGPACK_MEDIA_TYPES}}
+
+def _payload(model: Type[BaseModel], **values) -> Dict[str, Any]:
+    """
+    Wire form of a response model, with the model's defaults for omitted fields.
+
+    Values come from service results that are already validated, so they
+    are not validated again; orjson encodes the result directly.
+    """
+    return dict(model.model_construct(**values))
+
+def _detection_payload(result: Union[DetectionResponse, ErrorResponse]) -> Dict[str, Any]:
+    """Wire form of a service result, which is already the route's response model"""
+    return dict(result)
+
 @router.post(
     "/image", 
     response_model=DetectionResponse,
-    responses={400: {"model": ErrorResponse}, 500: {"model": ErrorResponse}}
+    responses={
+        200: MSGPACK_CONTENT,
+        400: {"model": ErrorResponse},
+        500: {"model": ErrorResponse},
+        504: {"description": "Deadline exceeded"}
+    }
 )
 async def detect_objects(
+    request: Request,
     file: UploadFile = File(..., description="Image file to process"),
-    threshold: Optional[float] = Query(None, description="Detection confidence threshold")
+    threshold: Optional[float] = Query(None, description="Detection confidence threshold"),
+    priority: str = Depends(priority_for("interactive")),
+    deadline: Deadline = Depends(get_deadline),
+    filters: Optional[DetectionFilter] = Depends(get_detection_filter)
 ):
     """
     Detect fashion objects in an uploaded image.
     
     - **file**: Image file (JPEG, PNG, etc.)
     - **threshold**: Optional confidence threshold (default: 0.4)
+    - **labels**, **top_k**, **min_box_area**: Optional filters applied to each image's boxes
     """
     # Validate file type
     if not file.content_type.startswith('image/'):
@@ -37,50 +108,356 @@ async def detect_objects(
     
     # Read and process image
     try:
-        image_bytes = await file.read()
-        result = DetectionService.detect_from_bytes(image_bytes, threshold)
-        
-        if not result.success:
-            raise HTTPException(status_code=500, detail=result.error)
-            
-        return result
+        with timed_stage("upload_read"):
+            image_bytes = await file.read()
+        results = await _run_while_connected(
+            request, deadline, DetectionService.detect_images([image_bytes], threshold, priority, deadline, filters)
+        )
+        result = results[0]
         
+    except RequestCancelled as e:
+        return _cancelled_response(e)
     except Exception as e:
         raise HTTPException(
             status_code=500, 
             detail=f"Error processing image: {str(e)}"
         )
+    
+    # Undecodable uploads are the client's error; anything else failed on our side
+    status_code = 200
+    if not result.success:
+        status_code = 400 if result.error_code == "INVALID_IMAGE" else 500
+    return negotiated_response(_detection_payload(result), request.headers.get("accept"), status_code)
 
-@router.post("/batch", response_model=list[DetectionResponse])
+@router.post(
+    "/batch",
+    response_model=list[Union[DetectionResponse, ErrorResponse]],
+    responses={200: MSGPACK_CONTENT, 504: {"description": "Deadline exceeded"}}
+)
 async def detect_objects_batch(
+    request: Request,
     files: list[UploadFile] = File(..., description="Multiple image files to process"),
-    threshold: Optional[float] = Query(None, description="Detection confidence threshold")
+    threshold: Optional[float] = Query(None, description="Detection confidence threshold"),
+    priority: str = Depends(priority_for("bulk")),
+    deadline: Deadline = Depends(get_deadline),
+    filters: Optional[DetectionFilter] = Depends(get_detection_filter)
 ):
     """
     Detect fashion objects in multiple uploaded images.
     
     - **files**: Multiple image files
     - **threshold**: Optional confidence threshold (default: 0.4)
+    - **labels**, **top_k**, **min_box_area**: Optional filters applied to each image's boxes
     """
-    results = []
+    results = [None] * len(files)
+    images_bytes, positions = [], []
     
-    for file in files:
+    for index, file in enumerate(files):
         try:
             if not file.content_type.startswith('image/'):
-                results.append(ErrorResponse(
+                results[index] = _payload(
+                    ErrorResponse,
                     error="Invalid file type",
+                    error_code="INVALID_FILE_TYPE",
                     details=f"File {file.filename} is not an image"
-                ))
+                )
                 continue
             
-            image_bytes = await file.read()
-            result = DetectionService.detect_from_bytes(image_bytes, threshold)
-            results.append(result)
+            with timed_stage("upload_read"):
+                images_bytes.append(await file.read())
+            positions.append(index)
             
         except Exception as e:
-            results.append(ErrorResponse(
-                error="Processing error",
-                details=str(e)
-            ))
+            results[index] = _payload(
+                ErrorResponse, error="Processing error", error_code="PROCESSING_ERROR", details=str(e)
+            )
+    
+    # Images are scheduled in chunks so interactive requests can run in between
+    try:
+        detections = await _run_while_connected(
+            request, deadline, DetectionService.detect_images(images_bytes, threshold, priority, deadline, filters)
+        )
+    except RequestCancelled as e:
+        return _cancelled_response(e)
+    except Exception as e:
+        # Report the failure per file, as for files that could not be read
+        logger.error("Batch detection failed: %s", e, exc_info=True)
+        for index in positions:
+            results[index] = _payload(
+                ErrorResponse, error="Processing error", error_code="PROCESSING_ERROR", details=str(e)
+            )
+    else:
+        for index, result in zip(positions, detections):
+            results[index] = _detection_payload(result)
+    
+    return negotiated_response(results, request.headers.get("accept"))
+
+@router.post(
+    "/raw",
+    response_model=list[Union[DetectionResponse, ErrorResponse]],
+    responses={
+        200: MSGPACK_CONTENT,
+        400: {"description": "Payload does not match its declared shape"},
+        415: {"description": "Unsupported content type"},
+        504: {"description": "Deadline exceeded"}
+    },
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/x-npy": {"schema": {"type": "string", "format": "binary"}},
+                "application/octet-stream": {"schema": {"type": "string", "format": "binary"}}
+            }
+        }
+    }
+)
+async def detect_raw(
+    request: Request,
+    width: Optional[int] = Query(None, gt=0, description="Frame width for raw RGB bodies"),
+    height: Optional[int] = Query(None, gt=0, description="Frame height for raw RGB bodies"),
+    threshold: Optional[float] = Query(None, description="Detection confidence threshold"),
+    priority: str = Depends(priority_for("standard")),
+    deadline: Deadline = Depends(get_deadline),
+    filters: Optional[DetectionFilter] = Depends(get_detection_filter)
+):
+    """
+    Detect fashion objects in already decoded RGB frames, skipping image codecs.
+    
+    - **application/x-npy** body: uint8 array of shape (height, width, 3) or (frames, height, width, 3)
+    - **application/octet-stream** body: packed RGB bytes, one or more frames of **width** x **height**
+    - **threshold**: Optional confidence threshold (default: 0.4)
+    - **labels**, **top_k**, **min_box_area**: Optional filters applied to each image's boxes
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type not in ("application/x-npy", "application/octet-stream"):
+        raise HTTPException(
+            status_code=415,
+            detail="Content-Type must be application/x-npy or application/octet-stream"
+        )
+    if content_type == "application/octet-stream" and (width is None or height is None):
+        raise HTTPException(status_code=400, detail="width and height are required for raw RGB bodies")
+    
+    with timed_stage("upload_read"):
+        body = await request.body()
+    try:
+        with timed_stage("decode"):
+            if content_type == "application/x-npy":
+                frames = image_processor.frames_from_npy(body)
+            else:
+                frames = image_processor.frames_from_raw(body, width, height)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    async def detect_frames():
+        # The frames are already in memory, but are charged so queued requests account for them
+        async with memory_budget.reserve(memory_budget.decoded_cost(frames), deadline):
+            return await DetectionService.detect_decoded(list(frames), threshold, priority, deadline, filters)
+    
+    try:
+        results = await _run_while_connected(request, deadline, detect_frames())
+    except RequestCancelled as e:
+        return _cancelled_response(e)
+    return negotiated_response([_detection_payload(result) for result in results], request.headers.get("accept"))
+
+@router.post(
+    "/crops",
+    response_class=StreamingResponse,
+    responses={
+        200: {"content": {"application/zip": {}}, "description": "Zip archive of crops and detections.json"},
+        504: {"description": "Deadline exceeded"}
+    }
+)
+async def export_crops(
+    request: Request,
+    files: list[UploadFile] = File(..., description="Image files to crop detected items from"),
+    threshold: Optional[float] = Query(None, description="Detection confidence threshold"),
+    padding: float = Query(0.0, ge=0, le=1, description="Margin added around each box, as a fraction of its size"),
+    size: Optional[int] = Query(None, ge=16, le=4096, description="Fit crops within size x size pixels"),
+    format: str = Query("jpeg", pattern=f"^({'|'.join(CROP_FORMATS)})$", description="Crop image format"),
+    priority: str = Depends(priority_for("bulk")),
+    deadline: Deadline = Depends(get_deadline),
+    filters: Optional[DetectionFilter] = Depends(get_detection_filter)
+):
+    """
+    Detect fashion objects and download a crop of each one as a zip archive.
+    
+    - **files**: One or more image files
+    - **threshold**: Optional confidence threshold (default: 0.4)
+    - **padding**, **size**, **format**: Crop margin, maximum crop size and encoding
+    - **labels**, **top_k**, **min_box_area**: Optional filters applied to each image's boxes
+    
+    The archive holds a folder of crops per image and a detections.json with
+    each image's detections and the archive path of every crop.
+    """
+    names = [file.filename or f"image_{index}" for index, file in enumerate(files)]
+    images_bytes = []
+    for file in files:
+        with timed_stage("upload_read"):
+            images_bytes.append(await file.read())
     
-    return results
\ No newline at end of file
+    # The decoded images are held until the archive is sent
+    reserved = 0
+    
+    async def decode_and_detect():
+        nonlocal images_bytes, reserved
+        reserved = await memory_budget.acquire(memory_budget.encoded_cost(images_bytes), deadline)
+        # Decode once and keep the images, so crops are cut from the same pixels the model saw
+        decoded = await asyncio.gather(*(
+            inference_scheduler.decode(DetectionService.decode_image, image_bytes, priority=priority)
+            for image_bytes in images_bytes
+        ))
+        images_bytes = None
+        positions = [index for index, image in enumerate(decoded) if not isinstance(image, ErrorResponse)]
+        detections = await DetectionService.detect_decoded(
+            [decoded[index] for index in positions], threshold, priority, deadline, filters
+        )
+        return decoded, positions, detections
+    
+    try:
+        decoded, positions, detections = await _run_while_connected(request, deadline, decode_and_detect())
+    except RequestCancelled as e:
+        memory_budget.release(reserved)
+        return _cancelled_response(e)
+    except BaseException:
+        memory_budget.release(reserved)
+        raise
+    
+    items = [(name, None, image) for name, image in zip(names, decoded)]
+    for index, result in zip(positions, detections):
+        items[index] = (names[index], decoded[index], result)
+    
+    return StreamingResponse(
+        _release_after(crop_service.stream_archive(items, padding, size, format), reserved),
+        media_type="application/zip",
+        headers={"Content-Disposition": 'attachment; filename="crops.zip"'}
+    )
+
+async def _release_after(chunks: AsyncIterator[bytes], reserved: int) -> AsyncIterator[bytes]:
+    """Stream chunks, then return their images' reservation to the memory budget however the stream ends"""
+    try:
+        async for chunk in chunks:
+            yield chunk
+    finally:
+        memory_budget.release(reserved)
+
+def _file_payload(path: str, result: Union[DetectionResponse, ErrorResponse]) -> Dict[str, Any]:
+    """Wire form of FileDetectionResponse for one ingested file"""
+    if not result.success:
+        return _payload(
+            FileDetectionResponse,
+            path=path,
+            success=False,
+            error=result.error,
+            error_code=result.error_code,
+            details=result.details
+        )
+    return _payload(
+        FileDetectionResponse,
+        path=path,
+        success=True,
+        detections=result.detections,
+        processing_time=result.processing_time,
+        image_size=result.image_size
+    )
+
+async def _read_files(files: List[Tuple[str, str]]) -> List[Union[bytes, ErrorResponse]]:
+    return await asyncio.gather(*(asyncio.to_thread(file_ingest_service.read, real) for _, real in files))
+
+async def _detect_file_chunks(
+    files: List[Tuple[str, str]],
+    threshold: Optional[float],
+    priority: str,
+    deadline: Deadline,
+    filters: Optional[DetectionFilter]
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """Detect files chunk by chunk, reading the next chunk while the current one runs"""
+    size = max(settings.INGEST_CHUNK_SIZE, 1)
+    chunks = [files[start:start + size] for start in range(0, len(files), size)]
+    reading = asyncio.ensure_future(_read_files(chunks[0])) if chunks else None
+    try:
+        for index, chunk in enumerate(chunks):
+            contents = await reading
+            reading = asyncio.ensure_future(_read_files(chunks[index + 1])) if index + 1 < len(chunks) else None
+            
+            readable = [i for i, content in enumerate(contents) if isinstance(content, bytes)]
+            detections = await DetectionService.detect_images(
+                [contents[i] for i in readable], threshold, priority, deadline, filters
+            )
+            results = list(contents)
+            for i, result in zip(readable, detections):
+                results[i] = result
+            yield [_file_payload(path, result) for (path, _), result in zip(chunk, results)]
+    finally:
+        if reading is not None:
+            reading.cancel()
+
+async def _stream_file_results(request, files, threshold, priority, deadline, filters) -> AsyncIterator[bytes]:
+    """Yield one JSON line per file; a final error line reports a passed deadline"""
+    chunks = _detect_file_chunks(files, threshold, priority, deadline, filters)
+    try:
+        while True:
+            try:
+                # Each chunk is abandoned, with the ones queued behind it, if the client goes away
+                chunk = await _run_while_connected(request, deadline, chunks.__anext__())
+            except StopAsyncIteration:
+                return
+            for result in chunk:
+                yield dumps_json(result) + b"\n"
+    except DeadlineExceeded as e:
+        yield dumps_json({"error": str(e)}) + b"\n"
+    except RequestCancelled:
+        return
+
+@router.post(
+    "/files",
+    response_model=list[FileDetectionResponse],
+    responses={
+        200: MSGPACK_CONTENT,
+        400: {"description": "Too many files"},
+        403: {"description": "Path outside the ingest roots, or ingestion disabled"},
+        504: {"description": "Deadline exceeded"}
+    }
+)
+async def detect_files(
+    request: Request,
+    body: FileDetectionRequest,
+    threshold: Optional[float] = Query(None, description="Detection confidence threshold"),
+    stream: bool = Query(False, description="Stream one JSON line per file as results complete"),
+    priority: str = Depends(priority_for("bulk")),
+    deadline: Deadline = Depends(get_deadline),
+    filters: Optional[DetectionFilter] = Depends(get_detection_filter)
+):
+    """
+    Detect fashion objects in image files on a volume shared with the server.
+    
+    - **paths**: Files under the configured INGEST_ROOTS
+    - **glob**: Pattern selecting files under the ingest roots (e.g. "incoming/**/*.jpg")
+    - **threshold**: Optional confidence threshold (default: 0.4)
+    - **labels**, **top_k**, **min_box_area**: Optional filters applied to each image's boxes
+    - **stream**: Return newline-delimited JSON instead of a single list
+    """
+    try:
+        files = await asyncio.to_thread(file_ingest_service.resolve, body.paths, body.glob)
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if stream:
+        return StreamingResponse(
+            _stream_file_results(request, files, threshold, priority, deadline, filters),
+            media_type="application/x-ndjson"
+        )
+    
+    async def detect_all() -> List[Dict[str, Any]]:
+        return [
+            result
+            async for chunk in _detect_file_chunks(files, threshold, priority, deadline, filters)
+            for result in chunk
+        ]
+    
+    try:
+        results = await _run_while_connected(request, deadline, detect_all())
+    except RequestCancelled as e:
+        return _cancelled_response(e)
+    return negotiated_response(results, request.headers.get("accept"))
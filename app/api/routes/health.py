@@ -16,6 +16,6 @@ async def health_check():
     return HealthResponse(
         status="healthy",
         version=settings.VERSION,
-        model_loaded=model_service.model is not None,
+        model_loaded=model_service.loaded,
         device=str(model_service.device)
     )
\ No newline at end of file
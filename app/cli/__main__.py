@@ -0,0 +1,16 @@
+import argparse
+import sys
+
+from app.cli import detect, export_model, tune
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="Omni Synesis command line tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    detect.add_parser(subparsers)
+    export_model.add_parser(subparsers)
+    tune.add_parser(subparsers)
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,454 @@
+import importlib.util
+import json
+import os
+import signal
+import sys
+import tarfile
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif", ".tif", ".tiff"}
+TAR_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+# (id, path to read, or the bytes already read from an archive)
+Item = Tuple[str, Optional[str], Optional[bytes]]
+
+# (id, decoded RGB array or None, decode error or None)
+Decoded = Tuple[str, Any, Optional[str]]
+
+def add_parser(subparsers):
+    parser = subparsers.add_parser(
+        "detect",
+        help="Run detection over a directory, archive or list of images without the HTTP API",
+        description="Decode images in a worker pool and run batched detection in this process, "
+                    "writing one record per image as JSONL or Parquet. Progress is checkpointed "
+                    "next to the output, so rerunning the same command resumes an interrupted run."
+    )
+    parser.add_argument("source", type=Path,
+                        help="Directory (searched recursively), .zip/.tar archive, or text file listing one path per line")
+    parser.add_argument("--output", type=Path,
+                        help="JSONL file, or directory of Parquet parts (default: detections.jsonl / detections.parquet)")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default="jsonl", help="Output format")
+    parser.add_argument("--threshold", type=float, help="Detection confidence threshold (default: DETECTION_THRESHOLD)")
+    parser.add_argument("--labels", nargs="+", help="Only keep these labels")
+    parser.add_argument("--top-k", type=int, help="Keep at most this many boxes per image")
+    parser.add_argument("--min-box-area", type=float, help="Drop boxes smaller than this many square pixels")
+    parser.add_argument("--batch-size", type=int, help="Images per forward pass (default: INFERENCE_BATCH_SIZE)")
+    parser.add_argument("--decode-workers", type=int, default=max(min((os.cpu_count() or 1) // 2, 8), 1),
+                        help="Processes reading and decoding images")
+    parser.add_argument("--prefetch", type=int, default=4, help="Batches decoded ahead of inference")
+    parser.add_argument("--checkpoint-seconds", type=float, default=10.0, help="How often to flush and checkpoint")
+    parser.add_argument("--restart", action="store_true", help="Discard existing output and checkpoint and start over")
+    parser.set_defaults(handler=run)
+
+def _is_image(name: str) -> bool:
+    return Path(name).suffix.lower() in IMAGE_EXTENSIONS
+
+def iter_items(source: Path, skip: int = 0) -> Iterator[Item]:
+    """Yield the images in a source in a stable order, after the first `skip`"""
+    index = 0
+    if source.is_dir():
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if not _is_image(name):
+                    continue
+                index += 1
+                if index > skip:
+                    path = os.path.join(root, name)
+                    yield Path(path).relative_to(source).as_posix(), path, None
+    elif source.suffix.lower() == ".zip":
+        with zipfile.ZipFile(source) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or not _is_image(info.filename):
+                    continue
+                index += 1
+                if index > skip:
+                    yield info.filename, None, archive.read(info)
+    elif source.name.lower().endswith(TAR_SUFFIXES):
+        # Streamed, so compressed archives are read once front to back
+        with tarfile.open(source, mode="r:*") as archive:
+            for member in archive:
+                if not member.isfile() or not _is_image(member.name):
+                    continue
+                index += 1
+                if index > skip:
+                    yield member.name, None, archive.extractfile(member).read()
+    else:
+        with open(source) as listing:
+            for line in listing:
+                entry = line.strip()
+                if not entry or entry.startswith("#"):
+                    continue
+                index += 1
+                if index > skip:
+                    yield entry, str(source.parent / entry), None
+
+def count_items(source: Path) -> Optional[int]:
+    """Number of images in a source, or None when counting would mean reading a compressed archive"""
+    if source.name.lower().endswith(TAR_SUFFIXES[1:]):
+        return None
+    if source.name.lower().endswith(".tar"):
+        with tarfile.open(source) as archive:
+            return sum(1 for member in archive if member.isfile() and _is_image(member.name))
+    if source.suffix.lower() == ".zip":
+        with zipfile.ZipFile(source) as archive:
+            return sum(1 for info in archive.infolist() if not info.is_dir() and _is_image(info.filename))
+    if source.is_dir():
+        return sum(1 for _, _, files in os.walk(source) for name in files if _is_image(name))
+    with open(source) as listing:
+        return sum(1 for line in listing if line.strip() and not line.strip().startswith("#"))
+
+def decode_item(item: Item) -> Decoded:
+    """Read and decode one image in a worker process"""
+    import numpy as np
+
+    from app.utils.image_processor import image_processor
+
+    item_id, path, data = item
+    try:
+        if data is None:
+            with open(path, "rb") as f:
+                data = f.read()
+        if not image_processor.validate_image(data):
+            return item_id, None, "Invalid image file"
+        return item_id, np.asarray(image_processor.convert_to_rgb(data)), None
+    except Exception as e:
+        return item_id, None, str(e)
+
+def detect_pipelined(
+    model_service,
+    batches: Iterator[List[Decoded]],
+    threshold: float,
+    filters=None
+) -> Iterator[Tuple[List[Decoded], Any]]:
+    """
+    Yield each batch in order with its detection results, or the exception that failed it.
+
+    The next batches are preprocessed (as many as the model service
+    prefetches) and the previous one postprocessed on worker threads while
+    the current one runs on the model.
+    """
+    def prepare(batch: List[Decoded]):
+        images = [array for _, array, _ in batch if array is not None]
+        return model_service.prepare_batch(images) if images else None
+
+    def finish(prepared) -> List[Dict[str, Any]]:
+        return model_service.finish_batch(prepared, threshold, filters=filters) if prepared is not None else []
+
+    def outcome(future: Future) -> Any:
+        try:
+            return future.result()
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="preprocess") as preprocess, \
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix="postprocess") as postprocess:
+        preparing = deque()
+        finishing = deque()
+
+        def forward_next():
+            batch, future = preparing.popleft()
+            try:
+                prepared = future.result()
+                if prepared is not None:
+                    model_service.forward_batch(prepared)
+            except Exception as e:
+                failed = Future()
+                failed.set_exception(e)
+                finishing.append((batch, failed))
+            else:
+                finishing.append((batch, postprocess.submit(finish, prepared)))
+
+        for batch in batches:
+            preparing.append((batch, preprocess.submit(prepare, batch)))
+            if len(preparing) > model_service.prefetch_batches:
+                forward_next()
+            # Hand back finished batches, waiting only once another has taken the model
+            while len(finishing) > 1 or (finishing and finishing[0][1].done()):
+                batch, future = finishing.popleft()
+                yield batch, outcome(future)
+        while preparing:
+            forward_next()
+        while finishing:
+            batch, future = finishing.popleft()
+            yield batch, outcome(future)
+
+class JSONLWriter:
+    """Appends records to a JSONL file; state is the file size at the last commit"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(path, "ab")
+
+    def restore(self, state: Dict[str, Any]):
+        # Drop records written after the last checkpoint
+        self._file.truncate(state["bytes"])
+        self._file.seek(state["bytes"])
+
+    def write(self, records: List[Dict[str, Any]]):
+        self._file.write(b"".join(json.dumps(record).encode() + b"\n" for record in records))
+
+    def commit(self) -> Dict[str, Any]:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return {"bytes": self._file.tell()}
+
+    def close(self):
+        self._file.close()
+
+class ParquetWriter:
+    """Writes records as numbered Parquet part files, one per commit"""
+
+    def __init__(self, path: Path):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self._pa, self._pq = pa, pq
+        box = pa.struct([(key, pa.float32()) for key in ("xmin", "ymin", "xmax", "ymax")])
+        self.schema = pa.schema([
+            ("id", pa.string()),
+            ("success", pa.bool_()),
+            ("width", pa.int32()),
+            ("height", pa.int32()),
+            ("detections", pa.list_(pa.struct([
+                ("label", pa.string()), ("score", pa.float32()), ("bounding_box", box)
+            ]))),
+            ("error", pa.string()),
+        ])
+        self.path = path
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._parts = 0
+        self._rows: List[Dict[str, Any]] = []
+
+    def restore(self, state: Dict[str, Any]):
+        self._parts = state["parts"]
+        # Drop parts written after the last checkpoint
+        for part in self.path.glob("part-*.parquet"):
+            if int(part.stem.split("-")[1]) >= self._parts:
+                part.unlink()
+
+    def write(self, records: List[Dict[str, Any]]):
+        for record in records:
+            size = record.get("image_size") or {}
+            self._rows.append({
+                "id": record["id"],
+                "success": record["success"],
+                "width": size.get("width"),
+                "height": size.get("height"),
+                "detections": record.get("detections", []),
+                "error": record.get("error"),
+            })
+
+    def commit(self) -> Dict[str, Any]:
+        if self._rows:
+            part = self.path / f"part-{self._parts:05d}.parquet"
+            staging = part.with_suffix(".tmp")
+            self._pq.write_table(self._pa.Table.from_pylist(self._rows, schema=self.schema), staging)
+            os.replace(staging, part)
+            self._parts += 1
+            self._rows = []
+        return {"parts": self._parts}
+
+    def close(self):
+        pass
+
+class Progress:
+    """Single-line progress on stderr with throughput and ETA"""
+
+    def __init__(self, total: Optional[int], done: int):
+        self.total = total
+        self.start_done = self.done = done
+        self.failed = 0
+        self.started = time.perf_counter()
+        self._last_print = 0.0
+        self._width = 0
+
+    def update(self, processed: int, failed: int, force: bool = False):
+        self.done += processed
+        self.failed += failed
+        now = time.perf_counter()
+        if not force and now - self._last_print < 0.5:
+            return
+        self._last_print = now
+        rate = (self.done - self.start_done) / max(now - self.started, 1e-9)
+        line = f"\r{self.done}" + (f"/{self.total}" if self.total is not None else "")
+        line += f" images  {rate:.1f} img/s  {self.failed} failed"
+        if self.total is not None and rate > 0:
+            line += f"  ETA {int((self.total - self.done) / rate)}s"
+        # Pad over the end of a longer previous line
+        self._width = max(self._width, len(line))
+        print(line.ljust(self._width), end="", file=sys.stderr, flush=True)
+
+class StopRequest:
+    """
+    Turns the first Ctrl+C into a request to stop between batches, so the
+    checkpoint written on the way out always matches the output. A second
+    Ctrl+C quits at once, falling back to the last periodic checkpoint.
+    """
+
+    def __init__(self):
+        self.requested = False
+
+    def __enter__(self) -> "StopRequest":
+        self._previous = signal.signal(signal.SIGINT, self._handle)
+        return self
+
+    def __exit__(self, *exc_info):
+        signal.signal(signal.SIGINT, self._previous)
+
+    def _handle(self, signum, frame):
+        if self.requested:
+            raise KeyboardInterrupt
+        self.requested = True
+        print("\nStopping after the current batch; press Ctrl+C again to quit now", file=sys.stderr)
+
+def _ignore_interrupts():
+    # Decode workers share the terminal's process group; the parent decides when to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def _write_checkpoint(path: Path, checkpoint: Dict[str, Any]):
+    staging = path.with_name(path.name + ".tmp")
+    staging.write_text(json.dumps(checkpoint, indent=2))
+    os.replace(staging, path)
+
+def run(args) -> int:
+    source = args.source.resolve()
+    if not source.exists():
+        print(f"{source} does not exist")
+        return 1
+    if args.format == "parquet" and importlib.util.find_spec("pyarrow") is None:
+        print("Parquet output needs pyarrow: pip install pyarrow")
+        return 1
+    output = args.output or Path(f"detections.{args.format}")
+    checkpoint_path = output.with_name(output.name + ".checkpoint.json")
+    identity = {"source": str(source), "format": args.format}
+
+    completed, state = 0, None
+    if args.restart:
+        checkpoint_path.unlink(missing_ok=True)
+        if output.is_dir():
+            for part in output.glob("part-*.parquet"):
+                part.unlink()
+        elif output.exists():
+            output.unlink()
+    elif checkpoint_path.exists():
+        checkpoint = json.loads(checkpoint_path.read_text())
+        if {key: checkpoint.get(key) for key in identity} != identity:
+            print(f"{checkpoint_path} belongs to a run over {checkpoint.get('source')}; pass --restart to start over")
+            return 1
+        if checkpoint.get("finished"):
+            print(f"{output} is already complete ({checkpoint['completed']} images); pass --restart to redo it")
+            return 0
+        completed, state = checkpoint["completed"], checkpoint["writer"]
+        print(f"Resuming after {completed} images")
+    elif output.exists():
+        print(f"{output} exists without a checkpoint; pass --restart to overwrite it")
+        return 1
+
+    # Loading the model is slow, so only once the arguments are known to be usable
+    from app.core.config import settings
+    from app.services.model_service import DetectionFilter, model_service
+
+    model_service.ensure_loaded()
+
+    threshold = settings.DETECTION_THRESHOLD if args.threshold is None else args.threshold
+    batch_size = max(args.batch_size or settings.INFERENCE_BATCH_SIZE, 1)
+    filters = None
+    if args.labels or args.top_k is not None or args.min_box_area is not None:
+        try:
+            label_ids = model_service.label_ids(args.labels) if args.labels else None
+        except ValueError as e:
+            print(str(e))
+            return 1
+        filters = DetectionFilter(label_ids, args.top_k, args.min_box_area)
+
+    writer = ParquetWriter(output) if args.format == "parquet" else JSONLWriter(output)
+    if state is not None:
+        writer.restore(state)
+    progress = Progress(count_items(source), completed)
+
+    def to_records(batch: List[Decoded], results: Any) -> List[Dict[str, Any]]:
+        records = [{"id": item_id, "success": False, "error": error} for item_id, _, error in batch]
+        decoded = [index for index, (_, array, _) in enumerate(batch) if array is not None]
+        if isinstance(results, Exception):
+            for index in decoded:
+                records[index]["error"] = str(results)
+        else:
+            for index, result in zip(decoded, results):
+                records[index] = {
+                    "id": batch[index][0],
+                    "success": True,
+                    "image_size": result["image_size"],
+                    "detections": result["detections"]
+                }
+        return records
+
+    def checkpoint(finished: bool = False):
+        _write_checkpoint(checkpoint_path, {
+            **identity, "completed": completed, "finished": finished, "writer": writer.commit()
+        })
+
+    items = iter_items(source, skip=completed)
+    window = batch_size * max(args.prefetch, 1)
+    # A checkpoint from the start, so even a forced quit leaves one to resume from
+    checkpoint()
+    last_checkpoint = time.perf_counter()
+    interrupted = False
+    try:
+        with StopRequest() as stop, ProcessPoolExecutor(
+            max_workers=max(args.decode_workers, 1), mp_context=get_context("spawn"), initializer=_ignore_interrupts
+        ) as pool:
+            pending = deque()
+
+            def fill():
+                # Keep a bounded number of images decoding ahead of the model
+                while len(pending) < window:
+                    item = next(items, None)
+                    if item is None:
+                        return
+                    pending.append(pool.submit(decode_item, item))
+
+            def batches() -> Iterator[List[Decoded]]:
+                fill()
+                while pending:
+                    batch = []
+                    while pending and len(batch) < batch_size:
+                        batch.append(pending.popleft().result())
+                        fill()
+                    yield batch
+
+            for batch, results in detect_pipelined(model_service, batches(), threshold, filters):
+                records = to_records(batch, results)
+                writer.write(records)
+                completed += len(records)
+                progress.update(len(records), sum(1 for record in records if not record["success"]))
+                # A stop request only takes effect here, once the batch is both written and counted
+                if stop.requested:
+                    interrupted = True
+                    break
+                if time.perf_counter() - last_checkpoint >= args.checkpoint_seconds:
+                    checkpoint()
+                    last_checkpoint = time.perf_counter()
+        checkpoint(finished=not interrupted)
+    except KeyboardInterrupt:
+        # Records written since the last checkpoint are truncated away on resume
+        progress.update(0, 0, force=True)
+        print("\nStopped; rerun the same command to resume from the last checkpoint", file=sys.stderr)
+        return 130
+    finally:
+        writer.close()
+
+    if interrupted:
+        progress.update(0, 0, force=True)
+        print(f"\nInterrupted after {completed} images; rerun the same command to resume", file=sys.stderr)
+        return 130
+    progress.update(0, 0, force=True)
+    print(f"\nWrote {completed} records to {output}", file=sys.stderr)
+    return 0
@@ -0,0 +1,56 @@
+import os
+import shutil
+from pathlib import Path
+
+def add_parser(subparsers):
+    parser = subparsers.add_parser(
+        "export-model",
+        help="Export a checkpoint to a local artifact directory for offline loading",
+        description="Download a detection checkpoint once, convert its weights to a single "
+                    "safetensors file, pin the processor config and write a manifest with "
+                    "checksums. Point MODEL_ARTIFACT_DIR at the output to load it without the Hub."
+    )
+    parser.add_argument("--checkpoint", help="Hub id or local path (default: MODEL_CHECKPOINT)")
+    parser.add_argument("--revision", help="Hub branch, tag or commit to pin")
+    parser.add_argument("--output", type=Path, default=Path("artifacts/model"), help="Artifact directory to write")
+    parser.add_argument("--force", action="store_true", help="Replace an existing artifact directory")
+    parser.set_defaults(handler=run)
+
+def run(args) -> int:
+    from transformers import AutoImageProcessor, AutoModelForObjectDetection
+
+    from app.core.config import settings
+    from app.utils.model_artifacts import WEIGHTS_NAME, write_manifest
+
+    checkpoint = args.checkpoint or settings.MODEL_CHECKPOINT
+    output = args.output
+    if output.exists() and not args.force:
+        print(f"{output} already exists; pass --force to replace it")
+        return 1
+
+    print(f"Exporting {checkpoint}" + (f"@{args.revision}" if args.revision else ""))
+    model = AutoModelForObjectDetection.from_pretrained(checkpoint, revision=args.revision)
+    processor = AutoImageProcessor.from_pretrained(checkpoint, revision=args.revision)
+    if hasattr(model.config, "use_pretrained_backbone"):
+        # The exported weights already include the backbone
+        model.config.use_pretrained_backbone = False
+
+    # Write next to the destination and swap it in, so a failed export never
+    # leaves a half-written directory where the server looks for one
+    staging = output.with_name(f"{output.name}.tmp")
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir(parents=True)
+    model.save_pretrained(staging, safe_serialization=True, max_shard_size="1000GB")
+    processor.save_pretrained(staging)
+    if not (staging / WEIGHTS_NAME).is_file():
+        print(f"Export did not produce {WEIGHTS_NAME}")
+        return 1
+    manifest = write_manifest(staging, checkpoint, args.revision)
+
+    if output.exists():
+        shutil.rmtree(output)
+    os.replace(staging, output)
+    for name, info in manifest["files"].items():
+        print(f"  {name:<28} {info['size']:>12} bytes  sha256 {info['sha256'][:16]}")
+    print(f"Wrote {output}; set MODEL_ARTIFACT_DIR={output} to load it offline")
+    return 0
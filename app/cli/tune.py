@@ -0,0 +1,143 @@
+import json
+import multiprocessing
+import os
+import statistics
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+EXAMPLES_DIR = Path(__file__).resolve().parents[2] / "static" / "examples"
+
+def add_parser(subparsers):
+    parser = subparsers.add_parser(
+        "tune",
+        help="Sweep torch threads, workers and batch sizes on this machine",
+        description="Measure detection throughput for combinations of intra-op threads, inter-op "
+                    "threads, worker processes and batch sizes using the bundled example images, "
+                    "then write the fastest configuration to the tuning file loaded by Settings."
+    )
+    parser.add_argument("--workers", type=int, nargs="+", help="Worker counts to try (default: powers of two up to the CPU count)")
+    parser.add_argument("--threads", type=int, nargs="+", help="Intra-op thread counts to try (default: derived from CPUs per worker)")
+    parser.add_argument("--interop-threads", type=int, nargs="+", default=[1, 2], help="Inter-op thread counts to try")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8], help="Batch sizes to try")
+    parser.add_argument("--duration", type=float, default=3.0, help="Seconds to measure each configuration")
+    parser.add_argument("--max-latency-ms", type=float, help="Reject configurations whose p95 batch latency exceeds this")
+    parser.add_argument("--pin", action="store_true", help="Pin each worker to its own CPU slice (sets CPU_AFFINITY)")
+    parser.add_argument("--output", type=Path, default=Path(os.getenv("TUNING_FILE", "tuning.json")),
+                        help="Tuning file to write")
+    parser.set_defaults(handler=run)
+
+def _available_cpus() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def _default_workers(cpus: int) -> List[int]:
+    workers, count = [], 1
+    while count <= cpus:
+        workers.append(count)
+        count *= 2
+    return workers
+
+def _default_threads(cpus: int, workers: int) -> List[int]:
+    share = max(cpus // workers, 1)
+    return sorted({share, max(share // 2, 1)}, reverse=True)
+
+def _worker(index: int, env: Dict[str, str], configs: List[Tuple[int, int]], duration: float,
+            barrier, results):
+    """Measure every (threads, batch size) configuration in one worker process"""
+    os.environ.update(env)
+    import torch
+
+    from app.services.model_service import model_service
+    from app.utils.image_processor import image_processor
+
+    model_service.ensure_loaded()
+    images = [image_processor.convert_to_rgb(path.read_bytes()) for path in sorted(EXAMPLES_DIR.glob("*.png"))]
+    for threads, batch_size in configs:
+        torch.set_num_threads(threads)
+        batch = [images[i % len(images)] for i in range(batch_size)]
+        model_service.detect_batch(batch)  # warm up this batch shape
+        barrier.wait()
+        latencies = []
+        start = time.perf_counter()
+        while time.perf_counter() - start < duration:
+            call_start = time.perf_counter()
+            model_service.detect_batch(batch)
+            latencies.append(time.perf_counter() - call_start)
+        elapsed = time.perf_counter() - start
+        results.put((index, threads, batch_size, len(latencies) * batch_size / elapsed, latencies))
+
+def _measure_group(workers: int, interop: int, threads: List[int], batch_sizes: List[int],
+                   duration: float, pin: bool) -> List[Dict[str, Any]]:
+    """Run all thread/batch configurations for one worker count and inter-op setting"""
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    configs = [(t, b) for t in threads for b in batch_sizes]
+    env = {
+        "WORKERS": str(workers),
+        "CPU_AFFINITY": "true" if pin else "false",
+        "TORCH_INTEROP_THREADS": str(interop),
+        "TORCH_NUM_THREADS": str(threads[0])
+    }
+    processes = [
+        context.Process(target=_worker, args=(i, env, configs, duration, barrier, results))
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    samples = [results.get() for _ in range(workers * len(configs))]
+    for process in processes:
+        process.join()
+
+    measurements = []
+    for threads_per_worker, batch_size in configs:
+        runs = [s for s in samples if s[1] == threads_per_worker and s[2] == batch_size]
+        latencies = sorted(latency for run in runs for latency in run[4])
+        measurements.append({
+            "workers": workers,
+            "threads": threads_per_worker,
+            "interop_threads": interop,
+            "batch_size": batch_size,
+            "images_per_second": round(sum(run[3] for run in runs), 3),
+            "p50_batch_ms": round(statistics.median(latencies) * 1000, 3),
+            "p95_batch_ms": round(latencies[int(0.95 * (len(latencies) - 1))] * 1000, 3)
+        })
+    return measurements
+
+def run(args) -> int:
+    cpus = _available_cpus()
+    worker_counts = args.workers or _default_workers(cpus)
+    measurements = []
+    for workers in worker_counts:
+        threads = args.threads or _default_threads(cpus, workers)
+        for interop in args.interop_threads:
+            print(f"Measuring workers={workers} interop={interop} threads={threads} batch={args.batch_sizes}")
+            for result in _measure_group(workers, interop, threads, args.batch_sizes, args.duration, args.pin):
+                print(f"  threads={result['threads']:<3} batch={result['batch_size']:<3} "
+                      f"{result['images_per_second']:>8.2f} img/s  p95 {result['p95_batch_ms']:.1f} ms")
+                measurements.append(result)
+
+    candidates = [
+        m for m in measurements
+        if args.max_latency_ms is None or m["p95_batch_ms"] <= args.max_latency_ms
+    ]
+    if not candidates:
+        print("No configuration met the latency limit; nothing written")
+        return 1
+    best = max(candidates, key=lambda m: m["images_per_second"])
+
+    tuning = {
+        "WORKERS": best["workers"],
+        "TORCH_NUM_THREADS": best["threads"],
+        "TORCH_INTEROP_THREADS": best["interop_threads"],
+        "INFERENCE_BATCH_SIZE": best["batch_size"],
+        "CPU_AFFINITY": args.pin
+    }
+    args.output.write_text(json.dumps(tuning, indent=2) + "\n")
+    report_path = args.output.with_name(f"{args.output.stem}-report.json")
+    report_path.write_text(json.dumps({"cpus": cpus, "best": best, "measurements": measurements}, indent=2) + "\n")
+    print(f"Best: {best}")
+    print(f"Wrote {args.output} (loaded by Settings at startup) and {report_path}")
+    return 0
@@ -1,5 +1,6 @@
-from pydantic_settings import BaseSettings
-from typing import Optional
+from pydantic_settings import BaseSettings, JsonConfigSettingsSource
+from typing import Dict, List, Optional, Tuple
+import os
 
 class Settings(BaseSettings):
     # Application
@@ -14,15 +15,98 @@ class Settings(BaseSettings):
 
     # Model
     MODEL_CHECKPOINT: str = "yainage90/fashion-object-detection"
+    MODEL_ARTIFACT_DIR: Optional[str] = None  # written by `python -m app.cli export-model`; loaded offline
+    MODEL_VERIFY_CHECKSUMS: bool = False  # hash every artifact file at startup, not only ones modified since export
     DETECTION_THRESHOLD: float = 0.4
 
+    # Inference scheduling
+    INFERENCE_BATCH_SIZE: int = 4
+    SCHEDULER_POLICY: str = "weighted"  # "weighted" (fair queuing) or "strict" (with aging)
+    SCHEDULER_WEIGHTS: Dict[str, int] = {"interactive": 8, "standard": 3, "bulk": 1}
+    SCHEDULER_MAX_WAIT_SECONDS: float = 10.0
+    REQUEST_DEADLINE_SECONDS: Optional[float] = None  # overridden per request by X-Request-Timeout
+    DISCONNECT_POLL_SECONDS: float = 0.25
+    SHUTDOWN_DRAIN_SECONDS: float = 30.0  # wait this long for in-flight inference on shutdown
+
+    # Inference pipeline
+    PIPELINE_DECODE_WORKERS: int = 4  # threads decoding uploads
+    PIPELINE_DECODE_LOOKAHEAD: int = 1  # chunks of an upload decoded ahead of the one being submitted
+    PIPELINE_PREPROCESS_WORKERS: int = 1  # threads turning chosen batches into input tensors
+    PIPELINE_PREFETCH_BATCHES: Optional[int] = None  # batches prepared ahead of the one on the model; unset: 1, or 0 on a single CPU
+
+    # Shape buckets
+    SHAPE_BUCKETS: List[Tuple[int, int]] = []  # (width, height) batches are padded to; empty pads to the largest image
+    SHAPE_BUCKET_PREWARM: bool = True  # run one forward pass per bucket at startup
+
+    # Memory budget (unset disables admission control)
+    MEMORY_BUDGET_MB: Optional[int] = None  # decoded images of admitted requests plus one inference batch
+    MEMORY_BATCH_BUDGET_MB: int = 512  # estimated input tensors and activations of one forward pass
+    MEMORY_ACTIVATION_BYTES_PER_PIXEL: int = 256  # model activations per input pixel, for the estimates
+
+    # Shared-volume ingestion (/detect/files)
+    INGEST_ROOTS: List[str] = []  # directories the server may read images from; empty disables
+    INGEST_MAX_FILES: int = 1000
+    INGEST_MAX_SCAN: int = 100000  # directory entries a glob may visit before the request is refused
+    INGEST_CHUNK_SIZE: int = 32  # files read and detected at a time
+
+    # Crop export (/detect/crops)
+    CROP_WORKERS: int = 4  # threads encoding crops
+    CROP_JPEG_QUALITY: int = 90
+
+    # Near-duplicate reuse
+    NEAR_DUP_ENABLED: bool = False
+    NEAR_DUP_MAX_DISTANCE: int = 6  # bits out of the 64-bit perceptual hash
+    NEAR_DUP_CAPACITY: int = 50000
+    NEAR_DUP_THRESHOLD_FLOOR: Optional[float] = None  # cache detections down to this score
+
+    # Warm state snapshots (unset WARM_STATE_DIR disables them)
+    WARM_STATE_DIR: Optional[str] = None  # written on graceful shutdown, restored on startup
+    WARM_STATE_MAX_ENTRIES: int = 5000  # most requested near-duplicate cache entries kept (needs NEAR_DUP_ENABLED)
+    WARM_STATE_MAX_SHAPES: int = 8  # most used forward-pass input shapes prewarmed
+
+    # Runtime tuning (written by `python -m app.cli tune` to TUNING_FILE)
+    WORKERS: int = 1
+    TORCH_NUM_THREADS: Optional[int] = None
+    TORCH_INTEROP_THREADS: Optional[int] = None
+    CPU_AFFINITY: bool = False
+
     # Security
     SECRET_KEY: str = "xxx"
     ALGORITHM: str = ".xxx"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    ADMIN_SUBJECTS: List[str] = ["admin"]
+    TOKEN_CACHE_SIZE: int = 1024  # verified tokens kept until they expire; 0 disables
+    TOKEN_CACHE_MAX_TTL_SECONDS: float = 300.0  # for tokens without an exp claim
+
+    # Per-client limits on /detect, keyed by the token's "sub" claim
+    RATE_LIMIT_PER_SECOND: Optional[float] = None  # sustained requests per second; unset disables
+    RATE_LIMIT_BURST: int = 20
+    RATE_LIMIT_MAX_CONCURRENT: Optional[int] = None
+    RATE_LIMIT_OVERRIDES: Dict[str, Dict[str, float]] = {}  # {"sub": {"rate": 50, "burst": 100, "max_concurrent": 8}}
+    RATE_LIMIT_MAX_SUBJECTS: int = 10000  # idle clients beyond this are forgotten
+
+    # Logging
+    LOG_FORMAT: str = "json"  # "json" or "text"
+    LOG_QUEUE_SIZE: int = 10000  # records beyond this are dropped rather than blocking requests
+    LOG_SAMPLE_RATES: Dict[str, float] = {}  # e.g. {"INFO": 0.1} for high-volume records
+
+    # Profiling
+    PROFILE_DIR: str = "profiles"
+    PROFILE_MAX_SECONDS: float = 300.0
+    PROFILE_SAMPLE_INTERVAL: float = 0.005
+    TRACE_SAMPLE_RATE: float = 0.0
 
     class Config:
         env_file = ".env"
         case_sensitive = True
 
+    @classmethod
+    def settings_customise_sources(cls, settings_cls, init_settings, env_settings,
+                                   dotenv_settings, file_secret_settings):
+        # Environment and .env values take precedence over the tuning file
+        tuning_file = JsonConfigSettingsSource(
+            settings_cls, json_file=os.getenv("TUNING_FILE", "tuning.json")
+        )
+        return init_settings, env_settings, dotenv_settings, tuning_file, file_secret_settings
+
 settings = Settings()
\ No newline at end of file
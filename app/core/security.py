@@ -1,10 +1,55 @@
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from app.core.config import settings
+from app.utils.metrics import record_cache_lookup
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+class VerifiedTokenCache:
+    """Bounded LRU of verified tokens' claims, each kept until the token expires"""
+
+    def __init__(self, capacity: int, max_ttl: float):
+        self.capacity = capacity
+        self.max_ttl = max_ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        if self.capacity <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None and time.time() >= entry[1]:
+                del self._entries[token]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(token)
+        record_cache_lookup("token", entry is not None)
+        return entry[0] if entry is not None else None
+
+    def put(self, token: str, claims: Dict[str, Any]):
+        if self.capacity <= 0:
+            return
+        expires_at = time.time() + self.max_ttl
+        if "exp" in claims:
+            expires_at = float(claims["exp"])
+        with self._lock:
+            self._entries[token] = (claims, expires_at)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+token_cache = VerifiedTokenCache(settings.TOKEN_CACHE_SIZE, settings.TOKEN_CACHE_MAX_TTL_SECONDS)
+
 def create_access_token(data: dict, expires_delta: timedelta = None):
     """Create JWT access token"""
     to_encode = data.copy()
@@ -16,13 +61,23 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
-def verify_token(token: str):
-    """Verify JWT token"""
+def decode_token(token: str) -> Optional[dict]:
+    """Decode JWT token, returning its claims or None if invalid"""
+    # Tokens already verified are served from the cache until they expire;
+    # invalid tokens are never cached, so they are always fully checked
+    claims = token_cache.get(token)
+    if claims is not None:
+        return claims
     try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        return True
+        claims = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
     except JWTError:
-        return False
+        return None
+    token_cache.put(token, claims)
+    return claims
+
+def verify_token(token: str):
+    """Verify JWT token"""
+    return decode_token(token) is not None
 
 def get_password_hash(password: str):
     """Hash password"""
@@ -63,6 +63,7 @@ class FashionDetectionClient:
                 API_ENDPOINT,
                 files=files,
                 params=params,
+                headers={"X-Request-Timeout": "30"},
                 timeout=30
             )
             response.raise_for_status()
@@ -97,6 +98,7 @@ class FashionDetectionClient:
                 API_BATCH_ENDPOINT,
                 files=files,
                 params=params,
+                headers={"X-Request-Timeout": "60"},
                 timeout=60
             )
             response.raise_for_status()
@@ -1,11 +1,22 @@
-from fastapi import FastAPI
+import asyncio
+import os
+import time
+import uuid
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import RedirectResponse
+from prometheus_client import multiprocess
 
 from app.core.config import settings
-from app.api.routes import detection, health
+from app.api.routes import admin, detection, health, metrics
+from app.services.model_service import model_service
+from app.services.scheduler import inference_scheduler
+from app.services.warm_state_service import warm_state_service
 from app.utils.logger import logger
+from app.utils.metrics import IN_FLIGHT, REQUEST_LATENCY
+from app.utils.tracing import set_request_id
 
 from datetime import timedelta
 from app.core.security import create_access_token
@@ -38,6 +49,26 @@ app.add_middleware(
 # Include API routers
 app.include_router(health.router, prefix=settings.API_PREFIX)
 app.include_router(detection.router, prefix=settings.API_PREFIX)
+app.include_router(admin.router, prefix=settings.API_PREFIX)
+app.include_router(metrics.router)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Track in-flight requests and end-to-end latency"""
+    start_time = time.perf_counter()
+    request_id = request.headers.get("X-Request-ID", "")[:64] or uuid.uuid4().hex
+    set_request_id(request_id)
+    IN_FLIGHT.inc()
+    try:
+        response = await call_next(request)
+    finally:
+        IN_FLIGHT.dec()
+    route = request.scope.get("route")
+    REQUEST_LATENCY.labels(route=getattr(route, "path", "unmatched")).observe(
+        time.perf_counter() - start_time
+    )
+    response.headers["X-Request-ID"] = request_id
+    return response
 
 # Import and mount Gradio frontend
 try:
@@ -64,17 +95,34 @@ async def ui_redirect():
 async def startup_event():
     """Application startup events"""
     logger.info(f"{settings.APP_NAME} v{settings.VERSION} starting up...")
+    # Pinned here, in the serving process, so threads started later inherit the affinity
+    model_service.configure_cpu()
+    # Loading and prewarming run forward passes, so they are kept off the event loop
+    await asyncio.to_thread(model_service.ensure_loaded)
+    await asyncio.to_thread(warm_state_service.restore)
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Application shutdown events"""
     logger.info(f"{settings.APP_NAME} v{settings.VERSION} shutting down...")
+    # Let in-flight inference finish, so its results make it into the snapshot
+    if not await inference_scheduler.drain(settings.SHUTDOWN_DRAIN_SECONDS):
+        logger.warning(f"Inference still running after {settings.SHUTDOWN_DRAIN_SECONDS}s; shutting down anyway")
+    await inference_scheduler.shutdown()
+    await asyncio.to_thread(warm_state_service.snapshot)
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        # Drop this worker's live gauges from the combined metrics
+        multiprocess.mark_process_dead(os.getpid())
 
 if __name__ == "__main__":
     import uvicorn
+    # Several workers, or reloading, need an import string and re-import the
+    # app in each server process; a single worker serves this module's app
+    # rather than importing it a second time
     uvicorn.run(
-        "app.main:app",
+        "app.main:app" if settings.WORKERS > 1 or settings.DEBUG else app,
         host=settings.HOST,
         port=settings.PORT,
-        reload=settings.DEBUG
+        reload=settings.DEBUG,
+        workers=settings.WORKERS
     )
\ No newline at end of file
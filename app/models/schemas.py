@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Any, Dict, List, Optional, Union
 from datetime import datetime
 
 class BoundingBox(BaseModel):
@@ -16,12 +16,26 @@ class DetectionResult(BaseModel):
 class DetectionRequest(BaseModel):
     threshold: Optional[float] = Field(None, description="Detection threshold")
 
+class FileDetectionRequest(BaseModel):
+    paths: Optional[List[str]] = Field(None, description="Image paths, absolute or relative to the first ingest root")
+    glob: Optional[str] = Field(None, description="Glob pattern (supports **) selecting images under the ingest roots")
+
 class DetectionResponse(BaseModel):
     success: bool = Field(..., description="Request success status")
     detections: List[DetectionResult] = Field(..., description="List of detected objects")
     processing_time: float = Field(..., description="Time taken to process the image")
     image_size: dict = Field(..., description="Original image dimensions")
 
+class FileDetectionResponse(BaseModel):
+    path: str = Field(..., description="Path of the processed file")
+    success: bool = Field(..., description="Whether detection succeeded for this file")
+    detections: List[DetectionResult] = Field([], description="List of detected objects")
+    processing_time: Optional[float] = Field(None, description="Time taken to process the image")
+    image_size: Optional[dict] = Field(None, description="Original image dimensions")
+    error: Optional[str] = Field(None, description="Why the file could not be processed")
+    error_code: Optional[str] = Field(None, description="Error code for programmatic handling")
+    details: Optional[Dict[str, Any]] = Field(None, description="Additional error details")
+
 class HealthResponse(BaseModel):
     status: str = Field(..., description="Service status")
     version: str = Field(..., description="API version")
@@ -31,4 +45,24 @@ class HealthResponse(BaseModel):
 class ErrorResponse(BaseModel):
     success: bool = Field(False, description="Request success status")
     error: str = Field(..., description="Error message")
-    details: Optional[str] = Field(None, description="Additional error details")
\ No newline at end of file
+    error_code: Optional[str] = Field(None, description="Error code for programmatic handling")
+    details: Optional[Union[Dict[str, Any], str]] = Field(None, description="Additional error details")
+
+class ProfilingStatusResponse(BaseModel):
+    active: bool = Field(..., description="Whether a profiling session is running")
+    session_id: Optional[str] = Field(None, description="Current or last session identifier")
+    requests_profiled: int = Field(..., description="Requests seen by the running session")
+    max_requests: Optional[int] = Field(None, description="Request count that ends the session")
+    seconds_remaining: Optional[float] = Field(None, description="Time left before the session ends")
+    trace_sample_rate: float = Field(..., description="Fraction of requests recorded as stage traces")
+    artifacts: Dict[str, str] = Field(..., description="Files written by the last session")
+
+class NearDuplicateStatusResponse(BaseModel):
+    enabled: bool = Field(..., description="Whether uploads are checked against the near-duplicate cache")
+    entries: int = Field(..., description="Images currently cached")
+    capacity: int = Field(..., description="Maximum cached images")
+    max_distance: int = Field(..., description="Largest perceptual hash distance treated as a duplicate")
+    threshold_floor: Optional[float] = Field(None, description="Score down to which detections are cached")
+    hits: int = Field(..., description="Lookups answered from the cache")
+    misses: int = Field(..., description="Lookups that ran the model")
+    hit_ratio: float = Field(..., description="Fraction of lookups answered from the cache")
@@ -0,0 +1,119 @@
+import asyncio
+import io
+import json
+import re
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import PurePath
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Union
+
+from PIL import Image
+
+from app.core.config import settings
+from app.models.schemas import DetectionResponse, ErrorResponse
+from app.utils.image_processor import image_processor
+from app.utils.metrics import timed_stage
+
+CROP_FORMATS = {"jpeg": ("JPEG", "jpg"), "png": ("PNG", "png"), "webp": ("WEBP", "webp")}
+
+CropItem = Tuple[str, Optional[Image.Image], Union[DetectionResponse, ErrorResponse]]
+
+class _ArchiveSink(io.RawIOBase):
+    """Unseekable stream collecting archive bytes until they are drained"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def _safe_name(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", name).strip("._") or "item"
+
+class CropService:
+    """Encodes detected-item crops in a worker pool and streams them as a zip archive"""
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=max(settings.CROP_WORKERS, 1), thread_name_prefix="crop")
+
+    @staticmethod
+    def _encode_crop(
+        image: Image.Image,
+        bbox: Dict[str, float],
+        padding: float,
+        max_size: Optional[int],
+        format: str
+    ) -> bytes:
+        with timed_stage("crop"):
+            crop = image_processor.crop_box(image, bbox, padding, max_size)
+            return image_processor.encode_image(crop, format, settings.CROP_JPEG_QUALITY)
+
+    async def stream_archive(
+        self,
+        items: List[CropItem],
+        padding: float = 0.0,
+        max_size: Optional[int] = None,
+        format: str = "jpeg"
+    ) -> AsyncIterator[bytes]:
+        """
+        Yield a zip archive with one folder of crops per image and a
+        detections.json describing every image and the crop of each box.
+
+        Crops are already compressed, so entries are stored rather than
+        deflated, and each image's crops are sent as soon as they are encoded.
+        """
+        pil_format, extension = CROP_FORMATS[format]
+        loop = asyncio.get_running_loop()
+        sink = _ArchiveSink()
+        metadata = []
+
+        with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED) as archive:
+            for index, (filename, image, result) in enumerate(items):
+                if image is None or not result.success:
+                    metadata.append({
+                        "filename": filename,
+                        "success": False,
+                        "error": result.error,
+                        "details": result.details
+                    })
+                    continue
+
+                folder = f"{index:04d}_{_safe_name(PurePath(filename).stem)}"
+                crops = await asyncio.gather(*(
+                    loop.run_in_executor(
+                        self._executor, self._encode_crop, image, detection["bounding_box"], padding, max_size, pil_format
+                    )
+                    for detection in result.detections
+                ))
+
+                detections = []
+                for number, (detection, data) in enumerate(zip(result.detections, crops)):
+                    name = f"{folder}/{number:03d}_{_safe_name(detection['label'])}.{extension}"
+                    archive.writestr(name, data)
+                    detections.append({**detection, "crop": name})
+                metadata.append({
+                    "filename": filename,
+                    "success": True,
+                    "image_size": result.image_size,
+                    "processing_time": result.processing_time,
+                    "detections": detections
+                })
+                yield sink.drain()
+
+            with timed_stage("serialize"):
+                archive.writestr("detections.json", json.dumps(metadata, indent=2))
+        # Closing the archive writes its central directory
+        yield sink.drain()
+
+# Global crop service instance
+crop_service = CropService()
@@ -1,78 +1,243 @@
 from PIL import Image
-import io
-from typing import List, Dict, Any
+import asyncio
+import itertools
+import time
+from collections import deque
+from typing import List, Dict, Any, Optional, Sequence, Tuple, Union
 
-from app.services.model_service import model_service
-from app.models.responses import DetectionResponse, ErrorResponse
+from app.core.config import settings
+from app.services.memory_budget import memory_budget
+from app.services.model_service import DetectionFilter, ImageInput, model_service
+from app.services.near_duplicate_service import Fingerprint, near_duplicate_cache
+from app.services.scheduler import inference_scheduler
+from app.models.schemas import DetectionResponse, ErrorResponse
+from app.utils.deadline import Deadline, RequestCancelled
 from app.utils.image_processor import image_processor
 from app.utils.logger import logger
+from app.utils.metrics import timed_stage
 
 class DetectionService:
     @staticmethod
     def detect_from_bytes(image_bytes: bytes, threshold: float = None) -> DetectionResponse:
         """Detect objects from image bytes"""
-        try:
-            # Validate image
-            if not image_processor.validate_image(image_bytes):
-                return ErrorResponse(
-                    success=False,
-                    message="Invalid image file",
-                    error_code="INVALID_IMAGE",
-                    details={"file_type": "Unable to determine image format"}
-                )
-            
-            # Convert to RGB PIL Image
-            image = image_processor.convert_to_rgb(image_bytes)
-            image_info = image_processor.get_image_info(image)
-            
-            # Detect objects
-            result = model_service.detect_objects(image, threshold)
-            
-            return DetectionResponse(
-                success=True,
-                message="Detection completed successfully",
-                detections=result["detections"],
-                processing_time=round(result["processing_time"], 4),
-                image_size=result["image_size"],
-                total_detections=len(result["detections"])
-            )
-            
-        except Exception as e:
-            logger.error(f"Error in detection from bytes: {str(e)}", exc_info=True)
-            return ErrorResponse(
-                success=False,
-                message="Failed to process image",
-                error_code="PROCESSING_ERROR",
-                details={"error": str(e)},
-                stack_trace=str(e) if logger.level == 10 else None  # Only include stack trace in debug
-            )
+        image = DetectionService.decode_image(image_bytes)
+        if isinstance(image, ErrorResponse):
+            return image
+        return DetectionService.detect_from_pil(image, threshold)
     
     @staticmethod
     def detect_from_pil(image: Image.Image, threshold: float = None) -> DetectionResponse:
         """Detect objects from PIL Image"""
         try:
-            image_info = image_processor.get_image_info(image)
-            
-            # Detect objects
             result = model_service.detect_objects(image, threshold)
+            return DetectionService._build_response(result)
             
-            return DetectionResponse(
-                success=True,
-                message="Detection completed successfully",
-                detections=result["detections"],
-                processing_time=round(result["processing_time"], 4),
-                image_size=result["image_size"],
-                total_detections=len(result["detections"])
-            )
-            
         except Exception as e:
-            logger.error(f"Error in detection from PIL: {str(e)}", exc_info=True)
-            return ErrorResponse(
-                success=False,
-                message="Failed to process image",
-                error_code="PROCESSING_ERROR",
-                details={"error": str(e)}
-            )
+            logger.error("Error in detection from PIL: %s", e, exc_info=True)
+            return DetectionService._error_response(e)
+    
+    @staticmethod
+    async def detect_images(
+        images_bytes: List[bytes],
+        threshold: float = None,
+        priority: str = "standard",
+        deadline: Optional[Deadline] = None,
+        filters: Optional[DetectionFilter] = None
+    ) -> List[Union[DetectionResponse, ErrorResponse]]:
+        """
+        Detect objects in encoded images through the inference scheduler.
+        
+        Waits for memory budget for the decoded images before decoding them.
+        Raises RequestCancelled once the deadline passes or the request is abandoned.
+        """
+        async with memory_budget.reserve(memory_budget.encoded_cost(images_bytes), deadline):
+            return await DetectionService._detect_admitted(images_bytes, threshold, priority, deadline, filters)
+    
+    @staticmethod
+    async def _detect_admitted(
+        images_bytes: List[bytes],
+        threshold: float,
+        priority: str,
+        deadline: Optional[Deadline],
+        filters: Optional[DetectionFilter]
+    ) -> List[Union[DetectionResponse, ErrorResponse]]:
+        """Decode and detect images once their memory budget is held"""
+        if threshold is None:
+            threshold = settings.DETECTION_THRESHOLD
+        
+        size = inference_scheduler.chunk_size
+        starts = iter(range(0, len(images_bytes), size))
+        
+        def decode_chunk(start: int) -> List[asyncio.Future]:
+            # Decode off the event loop; invalid images get their own error response
+            # and near duplicates of earlier images are answered from the cache
+            return [
+                asyncio.ensure_future(inference_scheduler.decode(
+                    DetectionService._prepare_image, image_bytes, threshold, filters, priority=priority
+                ))
+                for image_bytes in images_bytes[start:start + size]
+            ]
+        
+        # Only a few chunks decode at a time, so a large upload does not fill the
+        # decode pool; each is submitted once decoded, while the next ones decode
+        lookahead = max(settings.PIPELINE_DECODE_LOOKAHEAD, 0)
+        decoding = deque(decode_chunk(start) for start in itertools.islice(starts, lookahead + 1))
+        detecting = []
+        try:
+            while decoding:
+                prepared = await asyncio.gather(*decoding[0])
+                decoding.popleft()
+                start = next(starts, None)
+                if start is not None:
+                    decoding.append(decode_chunk(start))
+                detecting.append(asyncio.ensure_future(
+                    DetectionService._detect_prepared(prepared, threshold, priority, deadline, filters)
+                ))
+            chunks = await asyncio.gather(*detecting)
+        except BaseException:
+            for task in [task for chunk in decoding for task in chunk] + detecting:
+                task.cancel()
+            raise
+        return [response for chunk in chunks for response in chunk]
+    
+    @staticmethod
+    async def _detect_prepared(
+        prepared: List[Tuple[Union[Image.Image, DetectionResponse, ErrorResponse], Optional[Fingerprint]]],
+        threshold: float,
+        priority: str,
+        deadline: Optional[Deadline],
+        filters: Optional[DetectionFilter]
+    ) -> List[Union[DetectionResponse, ErrorResponse]]:
+        """Detect the decoded images among prepared uploads, caching their raw results"""
+        pending = [index for index, (item, _) in enumerate(prepared) if isinstance(item, Image.Image)]
+        images = [prepared[index][0] for index in pending]
+        if deadline is not None:
+            deadline.check("submit")
+        
+        options = {"filters": filters}
+        if near_duplicate_cache.enabled and near_duplicate_cache.threshold_floor is not None:
+            options["raw_threshold"] = near_duplicate_cache.threshold_floor
+        try:
+            results = await inference_scheduler.submit(images, threshold, priority, deadline, **options)
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            logger.error("Error in detection from bytes: %s", e, exc_info=True)
+            error = DetectionService._error_response(e)
+            return [error if isinstance(item, Image.Image) else item for item, _ in prepared]
+        
+        responses = [item for item, _ in prepared]
+        for index, result in zip(pending, results):
+            fingerprint = prepared[index][1]
+            if fingerprint is not None:
+                near_duplicate_cache.store(fingerprint, result["raw_threshold"], result["raw"])
+            responses[index] = DetectionService._build_response(result)
+        return responses
+    
+    @staticmethod
+    async def detect_decoded(
+        images: Sequence[ImageInput],
+        threshold: float = None,
+        priority: str = "standard",
+        deadline: Optional[Deadline] = None,
+        filters: Optional[DetectionFilter] = None
+    ) -> List[Union[DetectionResponse, ErrorResponse]]:
+        """
+        Detect objects in decoded RGB images or frames (height x width x 3, uint8) through the inference scheduler.
+        
+        The caller is responsible for holding memory budget for the images.
+        Raises RequestCancelled once the deadline passes or the request is abandoned.
+        """
+        if deadline is not None:
+            deadline.check("submit")
+        try:
+            results = await inference_scheduler.submit(list(images), threshold, priority, deadline, filters=filters)
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            logger.error("Error in detection from decoded images: %s", e, exc_info=True)
+            return [DetectionService._error_response(e)] * len(images)
+        return [DetectionService._build_response(result) for result in results]
+    
+    @staticmethod
+    def _prepare_image(
+        image_bytes: bytes,
+        threshold: float,
+        filters: Optional[DetectionFilter] = None
+    ) -> Tuple[Union[Image.Image, DetectionResponse, ErrorResponse], Optional[Fingerprint]]:
+        """
+        Decode one upload, or answer it from the near-duplicate cache.
+        
+        Returns the decoded image with its fingerprint (None when the cache is
+        disabled), a finished response for a cache hit, or an error response.
+        """
+        if not near_duplicate_cache.enabled:
+            return DetectionService.decode_image(image_bytes), None
+        
+        start_time = time.perf_counter()
+        # JPEGs are hashed from a reduced decode so hits skip the full decode
+        image = None
+        fingerprint = near_duplicate_cache.fingerprint_encoded(image_bytes)
+        if fingerprint is None:
+            image = DetectionService.decode_image(image_bytes)
+            if isinstance(image, ErrorResponse):
+                return image, None
+            fingerprint = near_duplicate_cache.fingerprint(image)
+        
+        raw = near_duplicate_cache.lookup(fingerprint, threshold)
+        if raw is not None:
+            width, height = fingerprint[1]
+            return DetectionService._build_response({
+                "detections": model_service.build_detections(raw, threshold, filters),
+                "processing_time": time.perf_counter() - start_time,
+                "image_size": {"width": width, "height": height}
+            }), None
+        
+        if image is None:
+            image = DetectionService.decode_image(image_bytes)
+            if isinstance(image, ErrorResponse):
+                return image, None
+        return image, fingerprint
+    
+    @staticmethod
+    def decode_image(image_bytes: bytes) -> Union[Image.Image, ErrorResponse]:
+        """Validate and decode image bytes into an RGB PIL Image"""
+        try:
+            with timed_stage("decode"):
+                # Validate image
+                if not image_processor.validate_image(image_bytes):
+                    return ErrorResponse(
+                        error="Invalid image file",
+                        error_code="INVALID_IMAGE",
+                        details={"file_type": "Unable to determine image format"}
+                    )
+                
+                # Convert to RGB PIL Image
+                return image_processor.convert_to_rgb(image_bytes)
+        
+        except Exception as e:
+            logger.error("Error in detection from bytes: %s", e, exc_info=True)
+            return DetectionService._error_response(e)
+    
+    @staticmethod
+    def _build_response(result: Dict[str, Any]) -> DetectionResponse:
+        """Build a successful response from a model result"""
+        # Built from the model's own output, so field validation is skipped
+        return DetectionResponse.model_construct(
+            success=True,
+            detections=result["detections"],
+            processing_time=round(result["processing_time"], 4),
+            image_size=result["image_size"]
+        )
+    
+    @staticmethod
+    def _error_response(e: Exception) -> ErrorResponse:
+        """Build an error response for a failed detection"""
+        return ErrorResponse(
+            error="Failed to process image",
+            error_code="PROCESSING_ERROR",
+            details={"error": str(e)}
+        )
     
     @staticmethod
     def get_annotated_image(image: Image.Image, detections: List[Dict[str, Any]]) -> Image.Image:
@@ -0,0 +1,124 @@
+import fnmatch
+import glob
+import os
+from itertools import islice
+from typing import Iterator, List, Optional, Tuple, Union
+
+from app.core.config import settings
+from app.models.schemas import ErrorResponse
+from app.utils.metrics import timed_stage
+
+class FileIngestService:
+    """Resolves and reads image files from the configured ingest roots"""
+
+    def __init__(self):
+        self.roots = [os.path.realpath(root) for root in settings.INGEST_ROOTS]
+        self.max_files = settings.INGEST_MAX_FILES
+        self.max_scan = settings.INGEST_MAX_SCAN
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.roots)
+
+    def _is_allowed(self, real_path: str) -> bool:
+        return any(os.path.commonpath([real_path, root]) == root for root in self.roots)
+
+    def _absolute(self, path: str) -> str:
+        # Relative paths are taken relative to the first root
+        return os.path.normpath(path if os.path.isabs(path) else os.path.join(self.roots[0], path))
+
+    def _scan(self, directory: str, visited: List[int]) -> List[os.DirEntry]:
+        """List a directory, counting its entries towards INGEST_MAX_SCAN"""
+        try:
+            with os.scandir(directory) as entries:
+                entries = list(entries)
+        except OSError:
+            return []
+        visited[0] += len(entries)
+        if visited[0] > self.max_scan:
+            raise ValueError(f"Pattern scans more than {self.max_scan} entries; narrow it down")
+        return entries
+
+    def _glob(self, directory: str, segments: List[str], visited: List[int]) -> Iterator[str]:
+        """
+        Yield files under directory matching glob path segments.
+
+        Follows glob.glob(recursive=True): "**" spans any number of
+        directories and hidden names only match segments starting with a dot.
+        """
+        segment, rest = segments[0], segments[1:]
+        if segment == "**":
+            if rest:
+                yield from self._glob(directory, rest, visited)
+            for entry in self._scan(directory, visited):
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir():
+                    yield from self._glob(entry.path, segments, visited)
+                elif not rest and entry.is_file():
+                    yield entry.path
+            return
+        for entry in self._scan(directory, visited):
+            if entry.name.startswith(".") and not segment.startswith("."):
+                continue
+            if not fnmatch.fnmatchcase(entry.name, segment):
+                continue
+            if rest:
+                if entry.is_dir():
+                    yield from self._glob(entry.path, rest, visited)
+            elif entry.is_file():
+                yield entry.path
+
+    def resolve(self, paths: Optional[List[str]] = None, pattern: Optional[str] = None) -> List[Tuple[str, str]]:
+        """
+        Expand explicit paths and a glob into (requested path, real path) pairs.
+
+        Raises PermissionError if ingestion is disabled or anything resolves
+        outside the ingest roots (symlinks included), and ValueError if more
+        than INGEST_MAX_FILES files are requested or a glob would visit more
+        than INGEST_MAX_SCAN directory entries.
+        """
+        if not self.enabled:
+            raise PermissionError("File ingestion is disabled; configure INGEST_ROOTS")
+
+        candidates = [self._absolute(path) for path in paths or []]
+        if pattern:
+            pattern = self._absolute(pattern)
+            # Refuse patterns rooted outside the roots before walking anything
+            parts = pattern.split(os.sep)
+            first_magic = next((i for i, part in enumerate(parts) if glob.has_magic(part)), len(parts))
+            fixed = os.sep.join(parts[:first_magic]) or os.sep
+            if not self._is_allowed(os.path.realpath(fixed)):
+                raise PermissionError(f"Pattern {pattern} is outside the ingest roots")
+            if first_magic < len(parts):
+                matches = self._glob(fixed, parts[first_magic:], [0])
+                candidates.extend(sorted(islice(matches, self.max_files + 1)))
+            elif os.path.isfile(pattern):
+                candidates.append(pattern)
+
+        if len(candidates) > self.max_files:
+            raise ValueError(f"At most {self.max_files} files can be processed per request")
+
+        resolved = []
+        for path in candidates:
+            real_path = os.path.realpath(path)
+            if not self._is_allowed(real_path):
+                raise PermissionError(f"{path} is outside the ingest roots")
+            resolved.append((path, real_path))
+        return resolved
+
+    def read(self, path: str) -> Union[bytes, ErrorResponse]:
+        """Read a file's bytes, or describe why it could not be read"""
+        try:
+            with timed_stage("upload_read"):
+                with open(path, "rb") as f:
+                    return f.read()
+        except OSError as e:
+            return ErrorResponse(
+                error="Unable to read file",
+                error_code="FILE_READ_ERROR",
+                details={"error": e.strerror or str(e)}
+            )
+
+# Global file ingest service instance
+file_ingest_service = FileIngestService()
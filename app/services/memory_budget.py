@@ -0,0 +1,134 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Iterable, Optional, Sequence
+
+from app.core.config import settings
+from app.services.model_service import ImageInput, image_size
+from app.utils.deadline import Deadline
+from app.utils.image_processor import image_processor
+from app.utils.metrics import ADMISSION_WAIT, ADMISSION_WAITING, MEMORY_BUDGET, MEMORY_RESERVED
+
+MB = 1024 * 1024
+
+class MemoryBudget:
+    """
+    Admits requests only while the decoded images they hold fit in a memory budget.
+
+    Each request is charged the RGB bytes of its images, read from their
+    headers before anything is decoded, and waits in arrival order until the
+    charge fits. Inference runs one batch at a time, so MEMORY_BATCH_BUDGET_MB
+    of MEMORY_BUDGET_MB is set aside for the running batch and the scheduler
+    splits large images into batches that fit it. A request larger than the
+    whole budget is admitted once nothing else holds any, so it runs alone
+    rather than never.
+    """
+
+    def __init__(self):
+        self._reserved = 0
+        # Waiters are [bytes, future], granted in arrival order
+        self._waiters: Deque[list] = deque()
+        self.configure(settings.MEMORY_BUDGET_MB, settings.MEMORY_BATCH_BUDGET_MB)
+
+    def configure(self, budget_mb: Optional[int], batch_budget_mb: int):
+        """Set the budget; None disables admission control and memory-aware batching"""
+        self.enabled = budget_mb is not None
+        self.capacity = max(budget_mb - batch_budget_mb, 0) * MB if self.enabled else 0
+        self.batch_bytes = batch_budget_mb * MB if self.enabled else None
+        MEMORY_BUDGET.set(self.capacity)
+        self._wake()
+
+    @staticmethod
+    def encoded_cost(images_bytes: Iterable[bytes]) -> int:
+        """RGB bytes encoded images will take once decoded"""
+        total = 0
+        for image_bytes in images_bytes:
+            # Images without a readable header fail to decode and hold nothing
+            size = image_processor.peek_size(image_bytes)
+            if size is not None:
+                total += size[0] * size[1] * 3
+        return total
+
+    @staticmethod
+    def decoded_cost(images: Sequence[ImageInput]) -> int:
+        """RGB bytes held by decoded images"""
+        total = 0
+        for image in images:
+            width, height = image_size(image)
+            total += width * height * 3
+        return total
+
+    def _fits(self, nbytes: int) -> bool:
+        return self._reserved == 0 or self._reserved + nbytes <= self.capacity
+
+    def _reserve(self, nbytes: int):
+        self._reserved += nbytes
+        MEMORY_RESERVED.set(self._reserved)
+
+    def _wake(self):
+        while self._waiters:
+            nbytes, future = self._waiters[0]
+            if not future.done() and not self._fits(nbytes):
+                break
+            self._waiters.popleft()
+            if not future.done():
+                self._reserve(nbytes)
+                future.set_result(None)
+
+    async def acquire(self, nbytes: int, deadline: Optional[Deadline] = None) -> int:
+        """
+        Wait until nbytes fit in the budget and reserve them.
+
+        Returns the bytes reserved, to be passed to release. Raises
+        RequestCancelled if the deadline passes while waiting.
+        """
+        if not self.enabled:
+            return 0
+        if not self._waiters and self._fits(nbytes):
+            self._reserve(nbytes)
+            return nbytes
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = [nbytes, future]
+        self._waiters.append(waiter)
+        ADMISSION_WAITING.inc()
+        start = time.perf_counter()
+        try:
+            while not future.done():
+                if deadline is not None:
+                    deadline.check("admission")
+                await asyncio.wait({future}, timeout=deadline.remaining() if deadline is not None else None)
+        except BaseException:
+            if future.done() and not future.cancelled():
+                self.release(nbytes)
+            else:
+                future.cancel()
+                self._waiters.remove(waiter)
+                # Requests queued behind this one may fit now
+                self._wake()
+            raise
+        finally:
+            ADMISSION_WAITING.dec()
+            ADMISSION_WAIT.observe(time.perf_counter() - start)
+        return nbytes
+
+    def release(self, nbytes: int):
+        """Return bytes reserved by acquire and admit waiting requests that now fit"""
+        if not nbytes:
+            return
+        self._reserved -= nbytes
+        MEMORY_RESERVED.set(self._reserved)
+        self._wake()
+
+    @asynccontextmanager
+    async def reserve(self, nbytes: int, deadline: Optional[Deadline] = None) -> AsyncIterator[None]:
+        """Hold nbytes of the budget for the duration of the block"""
+        reserved = await self.acquire(nbytes, deadline)
+        try:
+            yield
+        finally:
+            self.release(reserved)
+
+# Global memory budget instance
+memory_budget = MemoryBudget()
@@ -1,18 +1,118 @@
 import torch
-from transformers import AutoImageProcessor, AutoModelForObjectDetection
+from transformers import AutoConfig, AutoImageProcessor, AutoModelForObjectDetection
+import numpy as np
 from PIL import Image
-from typing import List, Dict, Any
+from collections import Counter
+from itertools import chain
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple, Union
+import os
+import tempfile
+import threading
 import time
 
 from app.core.config import settings
+from app.utils.deadline import Deadline
 from app.utils.logger import logger
+from app.services.profiling_service import profiling_service
+from app.utils.metrics import (
+    BATCH_SIZE,
+    MODEL_LOAD_SECONDS,
+    MODEL_MEMORY,
+    PADDING_WASTE,
+    SHAPE_BUCKET_IMAGES,
+    timed_stage,
+)
+from app.utils.model_artifacts import WEIGHTS_NAME, mmap_safetensors, verify_manifest
+
+# Model inputs: PIL images, or decoded RGB frames as height x width x 3 uint8 arrays
+ImageInput = Union[Image.Image, np.ndarray]
+
+# Float32 RGB pixel values plus the int64 pixel mask, per padded input pixel
+INPUT_BYTES_PER_PIXEL = 3 * 4 + 8
+
+# (width, height) of a padded input shape
+Bucket = Tuple[int, int]
+
+# (batch size, height, width) of a forward pass's pixel values
+InputShape = Tuple[int, int, int]
+
+def image_size(image: ImageInput) -> Tuple[int, int]:
+    """(width, height) of a PIL image or an HWC array"""
+    if isinstance(image, np.ndarray):
+        return image.shape[1], image.shape[0]
+    return image.size
+
+class DetectionFilter:
+    """Per-request restrictions applied to an image's detection tensors"""
+    
+    def __init__(self, label_ids: Optional[torch.Tensor] = None, top_k: Optional[int] = None,
+                 min_box_area: Optional[float] = None):
+        self.label_ids = label_ids
+        self.top_k = top_k
+        self.min_box_area = min_box_area
+    
+    def apply(self, result: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+        """Keep allowed labels and large enough boxes, then the top_k by score"""
+        keep = None
+        if self.label_ids is not None:
+            keep = torch.isin(result["labels"], self.label_ids)
+        if self.min_box_area:
+            boxes = result["boxes"]
+            large = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1]) >= self.min_box_area
+            keep = large if keep is None else keep & large
+        if keep is not None:
+            result = {key: value[keep] for key, value in result.items()}
+        if self.top_k is not None:
+            top = result["scores"].topk(min(self.top_k, len(result["scores"]))).indices
+            result = {key: value[top] for key, value in result.items()}
+        return result
+
+class PreparedBatch:
+    """Input tensors for a batch of images, then the model outputs that replace them"""
+    
+    def __init__(self, sizes: List[Tuple[int, int]], groups: List[Tuple[Optional[Bucket], List[int]]],
+                 inputs: List[Optional[Dict[str, torch.Tensor]]], start_time: float):
+        self.sizes = sizes
+        self.groups = groups
+        self.inputs = inputs
+        self.outputs: List[Any] = []
+        self.start_time = start_time
 
 class ModelService:
     def __init__(self):
+        self._cpu_slot_lock = None
+        self._weights_mmap = None
+        self.shape_buckets: List[Bucket] = [tuple(bucket) for bucket in settings.SHAPE_BUCKETS]
+        # Identifies the loaded weights, so state derived from them is not reused with others
+        self.model_version: Optional[str] = None
+        # Forward passes run per input shape, so the common ones can be prewarmed after a restart
+        self.forward_shapes: Counter = Counter()
+        self._cpu_configured = False
+        self._loaded = False
+        self._load_lock = threading.Lock()
         self.device = self._get_device()
         self.image_processor = None
         self.model = None
-        self.load_model()
+    
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+    
+    def ensure_loaded(self):
+        """
+        Configure the CPUs and load the model on first use.
+
+        Not done at import, since a launcher supervising several workers
+        imports the app too and would hold a model copy and a CPU slot.
+        """
+        if self._loaded:
+            return
+        with self._load_lock:
+            if not self._loaded:
+                self.configure_cpu()
+                self.load_model()
+                self._loaded = True
     
     def _get_device(self) -> torch.device:
         """Determine the best available device"""
@@ -27,66 +127,370 @@ class ModelService:
             logger.info("Using CPU device")
         return device
     
+    def configure_cpu(self):
+        """
+        Apply CPU pinning and torch thread counts from settings, once.
+
+        Affinity is set for the calling thread and inherited by threads it
+        starts later, so servers call this from the main thread.
+        """
+        if self._cpu_configured:
+            return
+        self._cpu_configured = True
+        if not hasattr(os, "sched_getaffinity"):
+            cpus = list(range(os.cpu_count() or 1))
+        else:
+            cpus = sorted(os.sched_getaffinity(0))
+        
+        if settings.CPU_AFFINITY and settings.WORKERS > 1 and hasattr(os, "sched_setaffinity"):
+            cpus = self._claim_cpu_slot(cpus)
+            os.sched_setaffinity(0, cpus)
+            cpu_share = len(cpus)
+            logger.info(f"Pinned worker to CPUs {cpus}")
+        else:
+            cpu_share = max(len(cpus) // settings.WORKERS, 1)
+        
+        # Without an explicit setting, split the CPUs between workers so
+        # several torch thread pools do not oversubscribe the machine
+        num_threads = settings.TORCH_NUM_THREADS
+        if num_threads is None and settings.WORKERS > 1:
+            num_threads = cpu_share
+        if num_threads is not None:
+            torch.set_num_threads(num_threads)
+        if settings.TORCH_INTEROP_THREADS is not None:
+            try:
+                torch.set_num_interop_threads(settings.TORCH_INTEROP_THREADS)
+            except RuntimeError as e:
+                logger.warning(f"Could not set inter-op threads: {str(e)}")
+        logger.info(f"Torch using {torch.get_num_threads()} intra-op / {torch.get_num_interop_threads()} inter-op threads")
+    
+    @property
+    def prefetch_batches(self) -> int:
+        """Batches to prepare while another runs on the model"""
+        if settings.PIPELINE_PREFETCH_BATCHES is not None:
+            return max(settings.PIPELINE_PREFETCH_BATCHES, 0)
+        # On a single CPU, preparing ahead only competes with the forward pass
+        return 1 if self.device.type != "cpu" or torch.get_num_threads() > 1 else 0
+    
+    def _claim_cpu_slot(self, cpus: List[int]) -> List[int]:
+        """Reserve one of WORKERS equal slices of the CPUs for this process"""
+        import fcntl
+        
+        per_worker = max(len(cpus) // settings.WORKERS, 1)
+        for slot in range(settings.WORKERS):
+            handle = open(os.path.join(tempfile.gettempdir(), f"omni-cpu-slot-{slot}.lock"), "w")
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                handle.close()
+                continue
+            # The lock is held for the life of the process and released on exit
+            self._cpu_slot_lock = handle
+            return cpus[slot * per_worker:(slot + 1) * per_worker] or cpus
+        logger.warning("No free CPU slot, running unpinned")
+        return cpus
+    
     def load_model(self):
         """Load the model and processor"""
         try:
-            logger.info(f"Loading model from {settings.MODEL_CHECKPOINT}")
-            self.image_processor = AutoImageProcessor.from_pretrained(settings.MODEL_CHECKPOINT)
-            self.model = AutoModelForObjectDetection.from_pretrained(settings.MODEL_CHECKPOINT).to(self.device)
+            start_time = time.perf_counter()
+            if settings.MODEL_ARTIFACT_DIR:
+                self._load_artifacts(Path(settings.MODEL_ARTIFACT_DIR))
+            else:
+                logger.info(f"Loading model from {settings.MODEL_CHECKPOINT}")
+                self.image_processor = AutoImageProcessor.from_pretrained(settings.MODEL_CHECKPOINT)
+                self.model = AutoModelForObjectDetection.from_pretrained(settings.MODEL_CHECKPOINT).to(self.device)
+                revision = getattr(self.model.config, "_commit_hash", None)
+                self.model_version = f"{settings.MODEL_CHECKPOINT}@{revision}" if revision else settings.MODEL_CHECKPOINT
             self.model.eval()
-            logger.info("Model loaded successfully")
+            if self.shape_buckets and settings.SHAPE_BUCKET_PREWARM:
+                self.prewarm_buckets()
+            load_time = time.perf_counter() - start_time
+            MODEL_LOAD_SECONDS.set(load_time)
+            self._record_model_memory()
+            logger.info(f"Model loaded successfully in {load_time:.2f}s")
         except Exception as e:
             logger.error(f"Error loading model: {str(e)}")
             raise
     
+    def _load_artifacts(self, artifact_dir: Path):
+        """Load a model exported by `python -m app.cli export-model` without the Hub"""
+        logger.info(f"Loading model artifacts from {artifact_dir}")
+        manifest = verify_manifest(artifact_dir, checksums=settings.MODEL_VERIFY_CHECKSUMS)
+        self.image_processor = AutoImageProcessor.from_pretrained(artifact_dir, local_files_only=True)
+        config = AutoConfig.from_pretrained(artifact_dir, local_files_only=True)
+        if hasattr(config, "use_pretrained_backbone"):
+            # The exported weights already include the backbone
+            config.use_pretrained_backbone = False
+        
+        # Build the modules without allocating or initializing weights, then
+        # adopt the memory-mapped tensors as parameters
+        state_dict, self._weights_mmap = mmap_safetensors(artifact_dir / WEIGHTS_NAME)
+        with torch.device("meta"):
+            model = AutoModelForObjectDetection.from_config(config)
+        _, unexpected = model.load_state_dict(state_dict, strict=False, assign=True)
+        model.tie_weights()
+        uninitialized = [
+            name for name, tensor in chain(model.named_parameters(), model.named_buffers()) if tensor.is_meta
+        ]
+        if uninitialized or unexpected:
+            logger.warning(
+                f"Memory-mapped load left {len(uninitialized)} tensors uninitialized and "
+                f"{len(unexpected)} unused, falling back to from_pretrained"
+            )
+            self._weights_mmap = None
+            model = AutoModelForObjectDetection.from_pretrained(artifact_dir, config=config, local_files_only=True)
+        
+        self.model = model.to(self.device)
+        self.model_version = f"sha256:{manifest['files'][WEIGHTS_NAME]['sha256']}"
+        logger.info(f"Loaded artifacts exported from {manifest['source']} ({manifest['created']})")
+    
+    def _record_model_memory(self):
+        """Publish the memory held by model parameters and buffers"""
+        tensors = list(self.model.parameters()) + list(self.model.buffers())
+        MODEL_MEMORY.labels(kind="weights").set(
+            sum(t.numel() * t.element_size() for t in tensors)
+        )
+        if self.device.type == "cuda":
+            MODEL_MEMORY.labels(kind="cuda_allocated").set(torch.cuda.memory_allocated(self.device))
+    
+    def prewarm_buckets(self):
+        """Run one forward pass per shape bucket so kernels for each shape are ready before traffic"""
+        self.prewarm_shapes([(1, height, width) for width, height in self.shape_buckets], "shape buckets")
+    
+    def prewarm_shapes(self, shapes: List[InputShape], description: str = "input shapes"):
+        """Run one forward pass per input shape so its kernels are selected before traffic"""
+        start_time = time.perf_counter()
+        with torch.no_grad():
+            for batch_size, height, width in shapes:
+                self.model(
+                    pixel_values=torch.zeros((batch_size, 3, height, width), device=self.device),
+                    pixel_mask=torch.ones((batch_size, height, width), dtype=torch.long, device=self.device)
+                )
+        logger.info(f"Prewarmed {len(shapes)} {description} in {time.perf_counter() - start_time:.2f}s")
+    
     def preprocess_image(self, image: Image.Image) -> Dict[str, torch.Tensor]:
         """Preprocess image for model input"""
-        return self.image_processor(images=[image], return_tensors="pt")
+        return self.preprocess_images([image])
+    
+    def preprocess_images(self, images: List[ImageInput], bucket: Optional[Bucket] = None) -> Dict[str, torch.Tensor]:
+        """Preprocess a batch of images for model input, padded to the bucket shape if one is given"""
+        # PIL images and arrays are both handled as channels-last, which also
+        # keeps tiny arrays from being mistaken for channels-first
+        if bucket is None:
+            return self.image_processor(images=images, return_tensors="pt", input_data_format="channels_last")
+        
+        pixel_values = self.image_processor(
+            images=images, do_pad=False, input_data_format="channels_last"
+        )["pixel_values"]
+        # Never crop if the processor resized an image past its bucket
+        width = max(bucket[0], *(values.shape[2] for values in pixel_values))
+        height = max(bucket[1], *(values.shape[1] for values in pixel_values))
+        padded = torch.zeros((len(pixel_values), pixel_values[0].shape[0], height, width))
+        pixel_mask = torch.zeros((len(pixel_values), height, width), dtype=torch.long)
+        for index, values in enumerate(pixel_values):
+            _, image_height, image_width = values.shape
+            padded[index, :, :image_height, :image_width] = torch.from_numpy(values)
+            pixel_mask[index, :image_height, :image_width] = 1
+        return {"pixel_values": padded, "pixel_mask": pixel_mask}
+    
+    def input_size(self, size: Tuple[int, int]) -> Tuple[int, int]:
+        """(width, height) the processor resizes an image of the given size to"""
+        width, height = size
+        target = self.image_processor.size if getattr(self.image_processor, "do_resize", False) else {}
+        if "shortest_edge" in target:
+            # Same rounding as the DETR-family processors
+            shortest = target["shortest_edge"]
+            longest = target.get("longest_edge")
+            if longest is not None and max(width, height) / min(width, height) * shortest > longest:
+                shortest = int(round(longest * min(width, height) / max(width, height)))
+            if width < height:
+                return shortest, int(shortest * height / width)
+            return int(shortest * width / height), shortest
+        if "height" in target and "width" in target:
+            return target["width"], target["height"]
+        return width, height
+    
+    def shape_bucket(self, size: Tuple[int, int]) -> Optional[Bucket]:
+        """Smallest configured bucket that holds an image of this size once resized, or None"""
+        width, height = self.input_size(size)
+        fitting = [bucket for bucket in self.shape_buckets if bucket[0] >= width and bucket[1] >= height]
+        return min(fitting, key=lambda bucket: bucket[0] * bucket[1]) if fitting else None
     
-    def postprocess_detections(self, outputs, target_sizes, threshold: float) -> List[Dict[str, Any]]:
-        """Postprocess model outputs into readable format"""
+    def group_by_bucket(self, sizes: List[Tuple[int, int]]) -> Dict[Optional[Bucket], List[int]]:
+        """Indices of the images in each shape bucket; None collects images no bucket fits"""
+        groups: Dict[Optional[Bucket], List[int]] = {}
+        for index, size in enumerate(sizes):
+            bucket = self.shape_bucket(size) if self.shape_buckets else None
+            groups.setdefault(bucket, []).append(index)
+        return groups
+    
+    def estimate_batch_memory(self, sizes: List[Tuple[int, int]]) -> int:
+        """Estimated bytes of input tensors and activations for the forward passes over images of these sizes"""
+        pixels = 0
+        for bucket, indices in self.group_by_bucket(sizes).items():
+            if bucket is None:
+                # The processor pads every image to the widest and tallest in the batch
+                inputs = [self.input_size(sizes[index]) for index in indices]
+                bucket = (max(width for width, _ in inputs), max(height for _, height in inputs))
+            pixels += len(indices) * bucket[0] * bucket[1]
+        return pixels * (INPUT_BYTES_PER_PIXEL + settings.MEMORY_ACTIVATION_BYTES_PER_PIXEL)
+    
+    def postprocess_outputs(self, outputs, target_sizes, threshold: float) -> List[Dict[str, torch.Tensor]]:
+        """Convert model outputs into per-image score, label and box tensors on the CPU"""
         results = self.image_processor.post_process_object_detection(
             outputs, threshold=threshold, target_sizes=target_sizes
-        )[0]
+        )
+        return [{key: value.cpu() for key, value in result.items()} for result in results]
+    
+    def postprocess_detections(self, outputs, target_sizes, threshold: float) -> List[List[Dict[str, Any]]]:
+        """Postprocess model outputs into readable format, one list per image"""
+        return [self.build_detections(result) for result in self.postprocess_outputs(outputs, target_sizes, threshold)]
+    
+    def label_ids(self, labels: List[str]) -> torch.Tensor:
+        """Map label names to class ids, rejecting names the model does not know"""
+        self.ensure_loaded()
+        label2id = {name.lower(): int(index) for index, name in self.model.config.id2label.items()}
+        unknown = [label for label in labels if label.lower() not in label2id]
+        if unknown:
+            raise ValueError(f"Unknown labels {unknown}; expected some of {sorted(label2id)}")
+        return torch.tensor([label2id[label.lower()] for label in labels])
+    
+    def build_detections(
+        self,
+        result: Dict[str, torch.Tensor],
+        threshold: float = None,
+        filters: Optional[DetectionFilter] = None
+    ) -> List[Dict[str, Any]]:
+        """Convert one image's scores, labels and boxes into detection dicts, filtering the tensors first"""
+        if threshold is not None:
+            keep = result["scores"] >= threshold
+            result = {key: value[keep] for key, value in result.items()}
+        if filters is not None:
+            result = filters.apply(result)
         
         detections = []
-        for score, label, box in zip(results["scores"], results["labels"], results["boxes"]):
+        for score, label, box in zip(result["scores"].tolist(), result["labels"].tolist(), result["boxes"].tolist()):
             detection = {
-                "label": self.model.config.id2label[label.item()],
-                "score": round(score.item(), 4),
+                "label": self.model.config.id2label[label],
+                "score": round(score, 4),
                 "bounding_box": {
-                    "xmin": round(box[0].item(), 2),
-                    "ymin": round(box[1].item(), 2),
-                    "xmax": round(box[2].item(), 2),
-                    "ymax": round(box[3].item(), 2)
+                    "xmin": round(box[0], 2),
+                    "ymin": round(box[1], 2),
+                    "xmax": round(box[2], 2),
+                    "ymax": round(box[3], 2)
                 }
             }
             detections.append(detection)
         
         return detections
     
-    def detect_objects(self, image: Image.Image, threshold: float = None) -> Dict[str, Any]:
-        """Main detection method"""
+    @staticmethod
+    def _record_padding(inputs: Dict[str, torch.Tensor], bucket: Optional[Bucket], count: int):
+        """Count the batch's images by bucket and observe how much of its input is padding"""
+        SHAPE_BUCKET_IMAGES.labels(bucket=f"{bucket[0]}x{bucket[1]}" if bucket else "none").inc(count)
+        pixel_mask = inputs.get("pixel_mask")
+        if pixel_mask is not None:
+            PADDING_WASTE.observe(1.0 - pixel_mask.sum().item() / pixel_mask.numel())
+    
+    def prepare_batch(self, images: List[ImageInput]) -> PreparedBatch:
+        """Preprocess images into input tensors on the model device, one set per shape bucket"""
+        start_time = time.perf_counter()
+        sizes = [image_size(image) for image in images]
+        groups = list(self.group_by_bucket(sizes).items())
+        inputs = []
+        # Each bucket is padded only to its own shape
+        for bucket, indices in groups:
+            with timed_stage("preprocess"):
+                group_inputs = self.preprocess_images([images[index] for index in indices], bucket)
+                group_inputs = {k: v.to(self.device) for k, v in group_inputs.items()}
+            self._record_padding(group_inputs, bucket, len(indices))
+            inputs.append(group_inputs)
+        return PreparedBatch(sizes, groups, inputs, start_time)
+    
+    def forward_batch(self, batch: PreparedBatch, deadline: Optional[Deadline] = None):
+        """Run one forward pass per shape bucket of a prepared batch, under the profiler during a session"""
+        with torch.no_grad(), profiling_service.inference_scope():
+            for position, (_, indices) in enumerate(batch.groups):
+                if deadline is not None:
+                    deadline.check("forward")
+                inputs = batch.inputs[position]
+                self.forward_shapes[(len(indices), *inputs["pixel_values"].shape[2:])] += 1
+                with timed_stage("forward"):
+                    BATCH_SIZE.observe(len(indices))
+                    batch.outputs.append(self.model(**inputs))
+                # Free the input tensors before the next pass allocates more
+                batch.inputs[position] = None
+                del inputs
+    
+    def finish_batch(
+        self,
+        batch: PreparedBatch,
+        threshold: float = None,
+        deadline: Optional[Deadline] = None,
+        raw_threshold: Optional[float] = None,
+        filters: Optional[DetectionFilter] = None
+    ) -> List[Dict[str, Any]]:
+        """Postprocess a batch's model outputs into per-image results"""
         if threshold is None:
             threshold = settings.DETECTION_THRESHOLD
+        kept_threshold = threshold if raw_threshold is None else min(threshold, raw_threshold)
+        if deadline is not None:
+            deadline.check("postprocess")
         
-        start_time = time.time()
-        
+        sizes = batch.sizes
+        raw: List[Optional[Dict[str, torch.Tensor]]] = [None] * len(sizes)
         with torch.no_grad():
-            inputs = self.preprocess_image(image)
-            inputs = {k: v.to(self.device) for k, v in inputs.items()}
-            
-            outputs = self.model(**inputs)
-            target_sizes = torch.tensor([[image.size[1], image.size[0]]]).to(self.device)
-            
-            detections = self.postprocess_detections(outputs, target_sizes, threshold)
-            processing_time = time.time() - start_time
+            with timed_stage("postprocess"):
+                for (_, indices), outputs in zip(batch.groups, batch.outputs):
+                    target_sizes = torch.tensor(
+                        [[sizes[index][1], sizes[index][0]] for index in indices]
+                    ).to(self.device)
+                    for index, result in zip(indices, self.postprocess_outputs(outputs, target_sizes, kept_threshold)):
+                        raw[index] = result
+                batch.outputs = []
+                detections = [
+                    self.build_detections(result, threshold if kept_threshold < threshold else None, filters)
+                    for result in raw
+                ]
+            processing_time = time.perf_counter() - batch.start_time
+        
+        return [
+            {
+                "detections": image_detections,
+                "raw": image_raw,
+                "raw_threshold": kept_threshold,
+                "processing_time": processing_time,
+                "image_size": {"width": width, "height": height}
+            }
+            for (width, height), image_detections, image_raw in zip(sizes, detections, raw)
+        ]
+    
+    def detect_batch(
+        self,
+        images: List[ImageInput],
+        threshold: float = None,
+        deadline: Optional[Deadline] = None,
+        raw_threshold: Optional[float] = None,
+        filters: Optional[DetectionFilter] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Detect objects in several images with one forward pass per shape bucket.
         
-        return {
-            "detections": detections,
-            "processing_time": processing_time,
-            "image_size": {"width": image.size[0], "height": image.size[1]}
-        }
+        Filters apply to each image's tensors before detections are built.
+        Each result also carries the unfiltered "raw" score, label and box
+        tensors, kept down to raw_threshold when that is below threshold so
+        callers can cache them for stricter requests later.
+        """
+        self.ensure_loaded()
+        batch = self.prepare_batch(images)
+        self.forward_batch(batch, deadline)
+        return self.finish_batch(batch, threshold, deadline, raw_threshold, filters)
+    
+    def detect_objects(self, image: ImageInput, threshold: float = None,
+                       filters: Optional[DetectionFilter] = None) -> Dict[str, Any]:
+        """Main detection method"""
+        return self.detect_batch([image], threshold, filters=filters)[0]
 
 # Global model service instance
 model_service = ModelService()
\ No newline at end of file
@@ -0,0 +1,221 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+from PIL import Image
+
+from app.core.config import settings
+from app.utils.image_processor import image_processor
+from app.utils.metrics import (
+    NEAR_DUP_DISTANCE,
+    NEAR_DUP_ENTRIES,
+    NEAR_DUP_MAX_DISTANCE,
+    cache_counts,
+    record_cache_lookup,
+    timed_stage,
+)
+
+# Crops and padding change what the boxes refer to, so only images whose
+# aspect ratios agree within this fraction count as duplicates
+MAX_ASPECT_DIFFERENCE = 0.02
+
+Fingerprint = Tuple[int, Tuple[int, int]]
+
+class BKTree:
+    """BK-tree over integer hashes using Hamming distance"""
+
+    def __init__(self):
+        # Nodes are [hash, value, {distance: child}]
+        self._root: Optional[list] = None
+
+    def add(self, key: int, value: Any):
+        node = [key, value, {}]
+        if self._root is None:
+            self._root = node
+            return
+        current = self._root
+        while True:
+            distance = (current[0] ^ key).bit_count()
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def search(self, key: int, max_distance: int) -> List[Tuple[int, Any]]:
+        """Return (distance, value) for every hash within max_distance bits of key"""
+        matches = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = (node[0] ^ key).bit_count()
+            if distance <= max_distance:
+                matches.append((distance, node[1]))
+            # The triangle inequality rules out subtrees outside this band
+            for child_distance, child in node[2].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        return matches
+
+class CachedDetections:
+    """Raw detections for one image, with boxes normalized to its size"""
+
+    __slots__ = ("key", "aspect", "threshold", "scores", "labels", "boxes", "hits")
+
+    # Fields written to and read from warm state snapshots
+    STATE_FIELDS = ("key", "aspect", "threshold", "scores", "labels", "boxes", "hits")
+
+    def __init__(self, key: int, size: Tuple[int, int], threshold: float, raw: Dict[str, torch.Tensor]):
+        width, height = size
+        self.key = key
+        self.aspect = width / height
+        self.threshold = threshold
+        self.scores = raw["scores"]
+        self.labels = raw["labels"]
+        self.boxes = raw["boxes"] / torch.tensor([width, height, width, height], dtype=raw["boxes"].dtype)
+        self.hits = 0
+
+    def state(self) -> Dict[str, Any]:
+        return {field: getattr(self, field) for field in self.STATE_FIELDS}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "CachedDetections":
+        entry = cls.__new__(cls)
+        for field in cls.STATE_FIELDS:
+            setattr(entry, field, state[field])
+        return entry
+
+    def rescaled(self, size: Tuple[int, int]) -> Dict[str, torch.Tensor]:
+        """Scores, labels and boxes in pixel coordinates of an image of the given size"""
+        width, height = size
+        scale = torch.tensor([width, height, width, height], dtype=self.boxes.dtype)
+        return {"scores": self.scores, "labels": self.labels, "boxes": self.boxes * scale}
+
+class NearDuplicateCache:
+    """
+    Reuses detections for uploads that are near duplicates of earlier images.
+
+    Images are fingerprinted with a 64-bit DCT perceptual hash, which survives
+    re-encoding, recompression and resizing, and indexed in a BK-tree so a
+    lookup only visits hashes that can be within the distance threshold.
+    Entries hold detections down to the threshold they were computed at and
+    serve any request with an equal or higher threshold. The least recently
+    used entries are evicted beyond NEAR_DUP_CAPACITY.
+    """
+
+    def __init__(self):
+        self.enabled = settings.NEAR_DUP_ENABLED
+        self.capacity = max(settings.NEAR_DUP_CAPACITY, 1)
+        self.threshold_floor = settings.NEAR_DUP_THRESHOLD_FLOOR
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[int, CachedDetections]" = OrderedDict()
+        self._tree = BKTree()
+        self._tree_size = 0
+        self._next_id = 0
+        self.set_max_distance(settings.NEAR_DUP_MAX_DISTANCE)
+
+    def set_max_distance(self, max_distance: int):
+        self.max_distance = max_distance
+        NEAR_DUP_MAX_DISTANCE.set(max_distance)
+
+    def fingerprint_encoded(self, image_bytes: bytes) -> Optional[Fingerprint]:
+        """Hash an encoded image from a reduced-size decode, if its format allows one"""
+        with timed_stage("fingerprint"):
+            thumbnail = image_processor.open_hash_thumbnail(image_bytes)
+            if thumbnail is None:
+                return None
+            image, size = thumbnail
+            return image_processor.perceptual_hash(image), size
+
+    def fingerprint(self, image: Image.Image) -> Fingerprint:
+        """Hash an already decoded image"""
+        with timed_stage("fingerprint"):
+            return image_processor.perceptual_hash(image), image.size
+
+    def lookup(self, fingerprint: Fingerprint, threshold: float) -> Optional[Dict[str, torch.Tensor]]:
+        """Return the closest cached detections rescaled to the image, or None"""
+        key, size = fingerprint
+        aspect = size[0] / size[1]
+        best = None
+        with self._lock:
+            for distance, entry_id in self._tree.search(key, self.max_distance):
+                entry = self._entries.get(entry_id)
+                if entry is None or entry.threshold > threshold:
+                    continue
+                if abs(entry.aspect - aspect) > MAX_ASPECT_DIFFERENCE * entry.aspect:
+                    continue
+                if best is None or distance < best[0]:
+                    best = (distance, entry_id, entry)
+            if best is not None:
+                self._entries.move_to_end(best[1])
+                best[2].hits += 1
+
+        record_cache_lookup("near_duplicate", best is not None)
+        if best is None:
+            return None
+        NEAR_DUP_DISTANCE.observe(best[0])
+        return best[2].rescaled(size)
+
+    def store(self, fingerprint: Fingerprint, threshold: float, raw: Dict[str, torch.Tensor]):
+        """Cache an image's raw detections, computed at the given threshold"""
+        key, size = fingerprint
+        with self._lock:
+            self._add(CachedDetections(key, size, threshold, raw))
+            NEAR_DUP_ENTRIES.set(len(self._entries))
+
+    def _add(self, entry: CachedDetections):
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = entry
+        self._tree.add(entry.key, entry_id)
+        self._tree_size += 1
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+        # Evicted hashes stay in the tree until it is rebuilt
+        if self._tree_size > 2 * self.capacity:
+            self._rebuild()
+
+    def export(self, limit: int) -> List[Dict[str, Any]]:
+        """The most requested entries, least recently used first, as plain state"""
+        with self._lock:
+            entries = list(self._entries.values())
+        ranks = sorted(range(len(entries)), key=lambda index: entries[index].hits, reverse=True)[:limit]
+        return [entries[index].state() for index in sorted(ranks)]
+
+    def load(self, states: List[Dict[str, Any]]) -> int:
+        """Add exported entries in order, the last becoming the most recently used; returns the entries cached"""
+        with self._lock:
+            for state in states:
+                self._add(CachedDetections.from_state(state))
+            NEAR_DUP_ENTRIES.set(len(self._entries))
+            return len(self._entries)
+
+    def _rebuild(self):
+        self._tree = BKTree()
+        for entry_id, entry in self._entries.items():
+            self._tree.add(entry.key, entry_id)
+        self._tree_size = len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._rebuild()
+            NEAR_DUP_ENTRIES.set(0)
+
+    def stats(self) -> Dict[str, Any]:
+        counts = cache_counts("near_duplicate")
+        lookups = counts["hits"] + counts["misses"]
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "capacity": self.capacity,
+            "max_distance": self.max_distance,
+            "threshold_floor": self.threshold_floor,
+            "hits": counts["hits"],
+            "misses": counts["misses"],
+            "hit_ratio": counts["hits"] / lookups if lookups else 0.0
+        }
+
+# Global near-duplicate cache instance
+near_duplicate_cache = NearDuplicateCache()
@@ -0,0 +1,264 @@
+import torch
+import atexit
+import json
+import os
+import queue
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, Optional
+
+from app.core.config import settings
+from app.utils.logger import logger
+from app.utils.tracing import RequestTrace, get_request_id
+
+class SamplingProfiler:
+    """Wall-clock sampling profiler producing folded stacks for flamegraphs"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Start sampling all threads in the background"""
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling and wait for the sampler thread to exit"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            thread_names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(
+                        f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                    )
+                    frame = frame.f_back
+                stack.append(thread_names.get(ident, str(ident)))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def write_folded(self, path: str):
+        """Write samples in folded-stack format (flamegraph.pl, speedscope)"""
+        with open(path, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+class TraceWriter:
+    """Appends sampled request traces to a JSON-lines file from a background thread"""
+
+    def __init__(self, maxsize: int):
+        self._queue: queue.Queue = queue.Queue(maxsize=maxsize)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def write(self, entry: Dict[str, Any]):
+        """Queue a trace for writing, dropping it rather than blocking when the writer falls behind"""
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="trace-writer", daemon=True)
+                    self._thread.start()
+                    atexit.register(self.close)
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            pass
+
+    def close(self):
+        """Write the queued traces and stop the writer thread"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            entries = [self._queue.get()]
+            # Append whatever else is queued in the same write
+            while entries[-1] is not None and not self._queue.empty():
+                entries.append(self._queue.get_nowait())
+            stop = entries[-1] is None
+            entries = [entry for entry in entries if entry is not None]
+            if entries:
+                try:
+                    os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+                    with open(os.path.join(settings.PROFILE_DIR, "traces.jsonl"), "a") as f:
+                        f.writelines(json.dumps(entry) + "\n" for entry in entries)
+                except OSError as e:
+                    logger.error(f"Could not write request traces: {str(e)}")
+            if stop:
+                return
+
+class ProfilingService:
+    """On-demand torch and Python profiling plus sampled request traces"""
+
+    def __init__(self):
+        self.trace_sample_rate = settings.TRACE_SAMPLE_RATE
+        self._lock = threading.Lock()
+        self._count_lock = threading.Lock()
+        self._trace_writer = TraceWriter(settings.LOG_QUEUE_SIZE)
+        self._profile_lock = threading.Lock()
+        self._session: Optional[Dict[str, Any]] = None
+        self._sampler: Optional[SamplingProfiler] = None
+        self._timer: Optional[threading.Timer] = None
+        self._artifacts: Dict[str, str] = {}
+
+    def start(self, max_requests: Optional[int] = None, seconds: Optional[float] = None) -> Dict[str, Any]:
+        """Start a profiling session bounded by a request count and/or duration"""
+        seconds = min(seconds or settings.PROFILE_MAX_SECONDS, settings.PROFILE_MAX_SECONDS)
+        with self._lock:
+            if self._session is not None:
+                raise RuntimeError("A profiling session is already running")
+            os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+            self._session = {
+                "id": datetime.utcnow().strftime("%Y%m%dT%H%M%S.%f"),
+                "max_requests": max_requests,
+                "requests": 0,
+                "deadline": time.monotonic() + seconds,
+                "trace_events": [],
+                "operators": {}
+            }
+            self._artifacts = {}
+            self._sampler = SamplingProfiler(settings.PROFILE_SAMPLE_INTERVAL)
+            self._sampler.start()
+            self._timer = threading.Timer(seconds, self.stop)
+            self._timer.daemon = True
+            self._timer.start()
+        logger.info(f"Profiling session {self._session['id']} started for {max_requests} requests / {seconds}s")
+        return self.status()
+
+    def stop(self) -> Dict[str, Any]:
+        """Stop the running session and write its artifacts"""
+        # Detach the session under the lock, then write files without holding
+        # it, so profiled inference calls never wait on the writes
+        with self._lock:
+            session, self._session = self._session, None
+            sampler, self._sampler = self._sampler, None
+            timer, self._timer = self._timer, None
+            if session is None:
+                return self.status()
+        timer.cancel()
+        sampler.stop()
+        artifacts = {"session_id": session["id"]}
+
+        folded_path = os.path.join(settings.PROFILE_DIR, f"python-{session['id']}.folded")
+        sampler.write_folded(folded_path)
+        artifacts["flamegraph"] = folded_path
+
+        if session["trace_events"]:
+            trace_path = os.path.join(settings.PROFILE_DIR, f"torch-{session['id']}.json")
+            with open(trace_path, "w") as f:
+                json.dump({"traceEvents": session["trace_events"]}, f)
+            artifacts["chrome_trace"] = trace_path
+
+            summary_path = os.path.join(settings.PROFILE_DIR, f"torch-{session['id']}.txt")
+            self._write_operator_summary(summary_path, session["operators"])
+            artifacts["operator_summary"] = summary_path
+
+        with self._lock:
+            # A session started meanwhile reports its own artifacts
+            if self._session is None:
+                self._artifacts = artifacts
+        logger.info(f"Profiling session {session['id']} stopped")
+        return self.status()
+
+    def status(self) -> Dict[str, Any]:
+        """Describe the current or last profiling session"""
+        session = self._session
+        return {
+            "active": session is not None,
+            "session_id": session["id"] if session else self._artifacts.get("session_id"),
+            "requests_profiled": session["requests"] if session else 0,
+            "max_requests": session["max_requests"] if session else None,
+            "seconds_remaining": round(max(session["deadline"] - time.monotonic(), 0.0), 3) if session else None,
+            "trace_sample_rate": self.trace_sample_rate,
+            "artifacts": {k: v for k, v in self._artifacts.items() if k != "session_id"}
+        }
+
+    @contextmanager
+    def inference_scope(self) -> Iterator[None]:
+        """Run a model call under the torch profiler while a session is active"""
+        # The Kineto trace behind torch.profiler is process-global, so only one
+        # call is profiled at a time; calls overlapping it run unprofiled
+        if self._session is None or not self._profile_lock.acquire(blocking=False):
+            yield
+            return
+        try:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            with torch.profiler.profile(activities=activities, record_shapes=True) as profiler:
+                yield
+            self._collect(profiler)
+        finally:
+            self._profile_lock.release()
+
+    def _collect(self, profiler):
+        """Merge one profiled call into the running session"""
+        with tempfile.NamedTemporaryFile(suffix=".json") as tmp:
+            profiler.export_chrome_trace(tmp.name)
+            with open(tmp.name) as f:
+                events = json.load(f).get("traceEvents", [])
+        with self._lock:
+            if self._session is None:
+                return
+            self._session["trace_events"].extend(events)
+            operators = self._session["operators"]
+            for event in profiler.key_averages():
+                totals = operators.setdefault(event.key, [0, 0.0, 0.0])
+                totals[0] += event.count
+                totals[1] += event.self_cpu_time_total
+                totals[2] += event.cpu_time_total
+
+    @staticmethod
+    def _write_operator_summary(path: str, operators: Dict[str, list]):
+        """Write operators sorted by self CPU time"""
+        rows = sorted(operators.items(), key=lambda item: item[1][1], reverse=True)
+        with open(path, "w") as f:
+            f.write(f"{'operator':<60} {'calls':>8} {'self_cpu_ms':>12} {'cpu_total_ms':>12}\n")
+            for name, (count, self_cpu, cpu_total) in rows:
+                f.write(f"{name[:60]:<60} {count:>8} {self_cpu / 1000:>12.3f} {cpu_total / 1000:>12.3f}\n")
+
+    def start_trace(self, route: str) -> RequestTrace:
+        """Start a request trace, marked for persistence if the request is sampled"""
+        sampled = self.trace_sample_rate > 0 and random.random() < self.trace_sample_rate
+        return RequestTrace(route, get_request_id(), sampled)
+
+    def request_finished(self, trace: Optional[RequestTrace] = None):
+        """
+        Queue a sampled trace for writing and count the request towards the session.
+
+        Called on the event loop, so the trace is written and a session that
+        reaches its request count is stopped in the background.
+        """
+        if trace is not None and trace.sampled:
+            self._trace_writer.write(trace.to_dict())
+        session = self._session
+        if session is None:
+            return
+        with self._count_lock:
+            session["requests"] += 1
+            # Exactly one request reaches the limit, so the session is stopped once
+            finished = session["requests"] == session["max_requests"]
+        if finished:
+            threading.Thread(target=self.stop, name="profiling-stop", daemon=True).start()
+
+# Global profiling service instance
+profiling_service = ProfilingService()
@@ -0,0 +1,94 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from app.core.config import settings
+from app.utils.metrics import RATE_LIMITED
+
+class ClientState:
+    """Token bucket and in-flight count for one client"""
+
+    __slots__ = ("tokens", "updated", "in_flight")
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated = now
+        self.in_flight = 0
+
+class RateLimiter:
+    """
+    Per-client token-bucket rate limits and concurrency limits.
+
+    Each client (the token's subject) may make RATE_LIMIT_PER_SECOND requests
+    per second on average, in bursts of up to RATE_LIMIT_BURST, with at most
+    RATE_LIMIT_MAX_CONCURRENT in flight. RATE_LIMIT_OVERRIDES gives
+    individual subjects their own "rate", "burst" and "max_concurrent".
+    """
+
+    def __init__(self):
+        self.rate = settings.RATE_LIMIT_PER_SECOND
+        self.burst = max(settings.RATE_LIMIT_BURST, 1)
+        self.max_concurrent = settings.RATE_LIMIT_MAX_CONCURRENT
+        self.overrides = settings.RATE_LIMIT_OVERRIDES
+        self.max_clients = max(settings.RATE_LIMIT_MAX_SUBJECTS, 1)
+        self._lock = threading.Lock()
+        self._clients: "OrderedDict[str, ClientState]" = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate is not None or self.max_concurrent is not None or bool(self.overrides)
+
+    def _limits(self, subject: str) -> Tuple[Optional[float], float, Optional[int]]:
+        override = self.overrides.get(subject, {})
+        rate = override.get("rate", self.rate)
+        burst = max(override.get("burst", self.burst), 1)
+        max_concurrent = override.get("max_concurrent", self.max_concurrent)
+        return rate, burst, int(max_concurrent) if max_concurrent is not None else None
+
+    def _client(self, subject: str, burst: float, now: float) -> ClientState:
+        client = self._clients.get(subject)
+        if client is None:
+            client = self._clients[subject] = ClientState(burst, now)
+            # Forget the least recently seen idle clients; a returning client starts with a full bucket
+            for other in list(self._clients):
+                if len(self._clients) <= self.max_clients:
+                    break
+                if self._clients[other].in_flight == 0 and other != subject:
+                    del self._clients[other]
+        self._clients.move_to_end(subject)
+        return client
+
+    def acquire(self, subject: str) -> Optional[Tuple[str, float]]:
+        """
+        Admit a request from a client, which must be followed by release.
+
+        Returns None when admitted, otherwise the limit that was hit and the
+        seconds after which a retry can succeed.
+        """
+        rate, burst, max_concurrent = self._limits(subject)
+        now = time.monotonic()
+        with self._lock:
+            client = self._client(subject, burst, now)
+            if max_concurrent is not None and client.in_flight >= max_concurrent:
+                RATE_LIMITED.labels(reason="concurrency").inc()
+                return "concurrency", 1.0
+            if rate is not None:
+                client.tokens = min(burst, client.tokens + (now - client.updated) * rate)
+                client.updated = now
+                if client.tokens < 1:
+                    RATE_LIMITED.labels(reason="rate").inc()
+                    return "rate", (1 - client.tokens) / rate if rate > 0 else 60.0
+                client.tokens -= 1
+            client.in_flight += 1
+        return None
+
+    def release(self, subject: str):
+        """Mark an admitted request from a client as finished"""
+        with self._lock:
+            client = self._clients.get(subject)
+            if client is not None and client.in_flight > 0:
+                client.in_flight -= 1
+
+# Global rate limiter instance
+rate_limiter = RateLimiter()
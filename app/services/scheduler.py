@@ -0,0 +1,354 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Set, Tuple, TypeVar
+
+from app.core.config import settings
+from app.services.memory_budget import memory_budget
+from app.services.model_service import ImageInput, PreparedBatch, image_size, model_service
+from app.utils.deadline import Deadline, RequestCancelled
+from app.utils.logger import logger
+from app.utils.metrics import (
+    CANCELLED_WORK,
+    DISPATCHED_IMAGES,
+    PIPELINE_BUSY_SECONDS,
+    PIPELINE_QUEUE_DEPTH,
+    PIPELINE_WORKERS,
+    QUEUE_DEPTH,
+    QUEUE_WAIT,
+)
+
+# Priority classes, most latency-sensitive first
+PRIORITY_CLASSES = ("interactive", "standard", "bulk")
+
+T = TypeVar("T")
+
+def _busy(stage: str, fn: Callable[..., T], *args, **kwargs) -> T:
+    """Call fn, counting its running time as busy time of a pipeline stage"""
+    start = time.perf_counter()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        PIPELINE_BUSY_SECONDS.labels(stage=stage).inc(time.perf_counter() - start)
+
+class WorkItem:
+    """A chunk of images from one request waiting for the model"""
+
+    def __init__(self, images: List[ImageInput], threshold: Optional[float], priority: str,
+                 deadline: Optional[Deadline], future: asyncio.Future, options: Dict[str, Any]):
+        self.images = images
+        self.threshold = threshold
+        self.options = options
+        self.priority = priority
+        self.deadline = deadline
+        self.future = future
+        # Run each stage in the submitting request's context so stage
+        # spans land in its trace
+        self.context = contextvars.copy_context()
+        self.enqueued_at = time.perf_counter()
+
+class InferenceScheduler:
+    """
+    Dispatches inference work to the model by priority class.
+
+    Requests are split into chunks of INFERENCE_BATCH_SIZE images so that
+    interactive work can be dispatched between the chunks of a large bulk
+    upload; with a memory budget, chunks of large images are made smaller
+    so each forward pass fits MEMORY_BATCH_BUDGET_MB. The "weighted" policy shares model time between classes in
+    proportion to SCHEDULER_WEIGHTS; the "strict" policy always serves the
+    highest class, with waiting work aging one class up every
+    SCHEDULER_MAX_WAIT_SECONDS so bulk traffic is never starved.
+    
+    Dispatched chunks run through a pipeline so the model is not idle while
+    CPU-bound work happens around it: uploads are decoded on their own pool
+    (through decode), PIPELINE_PREPROCESS_WORKERS threads turn chunks into
+    input tensors, a single inference thread runs the forward passes and a
+    postprocess thread turns outputs into detections. Decoding has its own
+    pool so a large upload cannot hold up the next chunk's preprocessing,
+    and waiting decodes start in priority class order so an interactive
+    upload does not wait behind a bulk one.
+    Up to ModelService.prefetch_batches chunks are prepared while one is on
+    the model, and a chunk is only chosen once there is room for it, so
+    priority is decided as late as possible. Queued chunks hold only their
+    input tensors, a small part of the estimate the memory budget charges a
+    forward pass.
+    """
+
+    def __init__(self):
+        self.policy = settings.SCHEDULER_POLICY
+        self.weights = {p: max(settings.SCHEDULER_WEIGHTS.get(p, 1), 1) for p in PRIORITY_CLASSES}
+        self.chunk_size = max(settings.INFERENCE_BATCH_SIZE, 1)
+        self.max_wait = settings.SCHEDULER_MAX_WAIT_SECONDS
+        self._queues: Dict[str, Deque[WorkItem]] = {p: deque() for p in PRIORITY_CLASSES}
+        self._virtual_time = {p: 0.0 for p in PRIORITY_CLASSES}
+        self._global_time = 0.0
+        self.prefetch = 0
+        workers = {
+            "decode": max(settings.PIPELINE_DECODE_WORKERS, 1),
+            "preprocess": max(settings.PIPELINE_PREPROCESS_WORKERS, 1),
+            # A single inference thread keeps model calls off the event loop and serialized
+            "forward": 1,
+            "postprocess": 1
+        }
+        self._executors = {
+            stage: ThreadPoolExecutor(max_workers=count, thread_name_prefix=stage)
+            for stage, count in workers.items()
+        }
+        # Decode jobs waiting for a decode thread, most urgent first
+        self._decode_waiting: List[Tuple[int, int, concurrent.futures.Future, Callable[[], Any]]] = []
+        self._decode_order = itertools.count()
+        self._decode_lock = threading.Lock()
+        for stage, count in workers.items():
+            PIPELINE_WORKERS.labels(stage=stage).set(count)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stages: List[asyncio.Task] = []
+        # Futures of chunks submitted and not yet answered
+        self._active: Set[asyncio.Future] = set()
+
+    def _ensure_started(self):
+        """Start the pipeline stages on the running event loop if needed"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or not self._stages or any(task.done() for task in self._stages):
+            if self._loop is loop:
+                # A stage died; restart all of them (stages on an older loop went with it)
+                for task in self._stages:
+                    task.cancel()
+            else:
+                self._active = set()
+            # Normally loaded by the startup hook; this covers apps run without one
+            model_service.ensure_loaded()
+            # Depends on the torch thread count, known once the model is set up
+            self.prefetch = model_service.prefetch_batches
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            # Chunks chosen but not yet through the forward pass
+            self._slots = asyncio.Semaphore(self.prefetch + 1)
+            self._prepared: asyncio.Queue = asyncio.Queue()
+            self._finishing: asyncio.Queue = asyncio.Queue(maxsize=max(self.prefetch, 1))
+            self._stages = [
+                loop.create_task(self._dispatch_loop()),
+                loop.create_task(self._inference_loop()),
+                loop.create_task(self._postprocess_loop())
+            ]
+
+    async def decode(self, fn: Callable[..., T], *args, priority: str = "standard") -> T:
+        """Run a request's decoding work on the pipeline's decode pool, ahead of less urgent classes"""
+        if priority not in self._queues:
+            raise ValueError(f"Unknown priority class: {priority}")
+        future = concurrent.futures.Future()
+        context = contextvars.copy_context()
+        job = functools.partial(context.run, _busy, "decode", fn, *args)
+        with self._decode_lock:
+            heapq.heappush(
+                self._decode_waiting, (PRIORITY_CLASSES.index(priority), next(self._decode_order), future, job)
+            )
+        # One run per job, each taking whichever waiting job is most urgent
+        self._executors["decode"].submit(self._decode_next)
+        return await asyncio.wrap_future(future)
+
+    def _decode_next(self):
+        """Run the most urgent waiting decode job, on a decode thread"""
+        with self._decode_lock:
+            _, _, future, job = heapq.heappop(self._decode_waiting)
+        if not future.set_running_or_notify_cancel():
+            # The request stopped waiting for it
+            return
+        try:
+            future.set_result(job())
+        except BaseException as e:
+            future.set_exception(e)
+
+    async def _run_stage(self, stage: str, item: WorkItem, fn: Callable[..., T], *args, **kwargs) -> T:
+        """Run one stage of a chunk on the stage's pool, in the submitting request's context"""
+        return await self._loop.run_in_executor(
+            self._executors[stage], item.context.run, functools.partial(_busy, stage, fn, *args, **kwargs)
+        )
+
+    async def submit(self, images: List[ImageInput], threshold: float = None,
+                     priority: str = "standard", deadline: Optional[Deadline] = None,
+                     **options) -> List[Dict[str, Any]]:
+        """Queue images for inference and wait for their results; options go to detect_batch"""
+        if priority not in self._queues:
+            raise ValueError(f"Unknown priority class: {priority}")
+        if not images:
+            return []
+        self._ensure_started()
+
+        items = []
+        for chunk in self._chunks(images):
+            item = WorkItem(chunk, threshold, priority, deadline, self._loop.create_future(), options)
+            self._active.add(item.future)
+            item.future.add_done_callback(self._active.discard)
+            self._enqueue(item)
+            items.append(item)
+        self._wakeup.set()
+
+        try:
+            chunks = await asyncio.gather(*(item.future for item in items))
+        except BaseException:
+            # Drop the remaining chunks of a failed or abandoned request
+            for item in items:
+                item.future.cancel()
+            raise
+        return [result for chunk in chunks for result in chunk]
+
+    def _chunks(self, images: List[ImageInput]) -> Iterator[List[ImageInput]]:
+        """Split images into chunks of at most chunk_size that fit the batch memory budget"""
+        if memory_budget.batch_bytes is None:
+            for start in range(0, len(images), self.chunk_size):
+                yield images[start:start + self.chunk_size]
+            return
+        chunk, sizes = [], []
+        for image in images:
+            size = image_size(image)
+            if chunk and (
+                len(chunk) == self.chunk_size
+                or model_service.estimate_batch_memory(sizes + [size]) > memory_budget.batch_bytes
+            ):
+                yield chunk
+                chunk, sizes = [], []
+            chunk.append(image)
+            sizes.append(size)
+        if chunk:
+            yield chunk
+
+    def _enqueue(self, item: WorkItem):
+        queue = self._queues[item.priority]
+        if not queue:
+            # A class returning from idle must not spend credit it built up while idle
+            self._virtual_time[item.priority] = max(self._virtual_time[item.priority], self._global_time)
+        queue.append(item)
+        QUEUE_DEPTH.labels(priority=item.priority).inc(len(item.images))
+
+    def _next_item(self) -> Optional[WorkItem]:
+        """Pick the next chunk to run according to the scheduling policy"""
+        waiting = [p for p in PRIORITY_CLASSES if self._queues[p]]
+        if not waiting:
+            return None
+        if self.policy == "strict":
+            now = time.perf_counter()
+            priority = min(
+                waiting,
+                key=lambda p: PRIORITY_CLASSES.index(p)
+                - (now - self._queues[p][0].enqueued_at) / self.max_wait
+            )
+        else:
+            priority = min(waiting, key=lambda p: self._virtual_time[p])
+        item = self._queues[priority].popleft()
+        self._global_time = self._virtual_time[priority]
+        self._virtual_time[priority] += len(item.images) / self.weights[priority]
+        QUEUE_DEPTH.labels(priority=priority).dec(len(item.images))
+        return item
+
+    async def _next_runnable(self) -> WorkItem:
+        """Wait for the next chunk that is still wanted"""
+        while True:
+            item = self._next_item()
+            if item is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            if item.future.done():
+                # The request was abandoned while this chunk was queued
+                reason = "disconnect" if item.deadline is not None and item.deadline.cancelled else "cancelled"
+                CANCELLED_WORK.labels(reason=reason, stage="dispatch").inc()
+                continue
+            if item.deadline is not None:
+                try:
+                    item.deadline.check("dispatch")
+                except RequestCancelled as e:
+                    item.future.set_exception(e)
+                    continue
+            QUEUE_WAIT.labels(priority=item.priority).observe(time.perf_counter() - item.enqueued_at)
+            DISPATCHED_IMAGES.labels(priority=item.priority).inc(len(item.images))
+            return item
+
+    @staticmethod
+    def _fail(item: WorkItem, e: Exception):
+        """Hand a stage's failure to the request waiting on the chunk"""
+        if not isinstance(e, RequestCancelled):
+            logger.error("Inference failed for %s chunk: %s", item.priority, e)
+        if not item.future.done():
+            item.future.set_exception(e)
+
+    async def _dispatch_loop(self):
+        while True:
+            # Choose a chunk only once the pipeline has room for it
+            await self._slots.acquire()
+            item = await self._next_runnable()
+            preparing = self._loop.create_task(
+                self._run_stage("preprocess", item, model_service.prepare_batch, item.images)
+            )
+            self._prepared.put_nowait((item, preparing))
+            PIPELINE_QUEUE_DEPTH.labels(queue="prepared").inc()
+
+    async def _inference_loop(self):
+        while True:
+            item, preparing = await self._prepared.get()
+            PIPELINE_QUEUE_DEPTH.labels(queue="prepared").dec()
+            try:
+                batch: PreparedBatch = await preparing
+                if item.future.done():
+                    CANCELLED_WORK.labels(reason="cancelled", stage="forward").inc()
+                    continue
+                await self._run_stage("forward", item, model_service.forward_batch, batch, item.deadline)
+            except Exception as e:
+                self._fail(item, e)
+                continue
+            finally:
+                self._slots.release()
+            # Waits when postprocessing falls behind, holding the next chunk back
+            await self._finishing.put((item, batch))
+            PIPELINE_QUEUE_DEPTH.labels(queue="postprocess").inc()
+
+    async def _postprocess_loop(self):
+        while True:
+            item, batch = await self._finishing.get()
+            PIPELINE_QUEUE_DEPTH.labels(queue="postprocess").dec()
+            if item.future.done():
+                CANCELLED_WORK.labels(reason="cancelled", stage="postprocess").inc()
+                continue
+            try:
+                results = await self._run_stage(
+                    "postprocess", item, model_service.finish_batch, batch, item.threshold, item.deadline, **item.options
+                )
+            except Exception as e:
+                self._fail(item, e)
+            else:
+                if not item.future.done():
+                    item.future.set_result(results)
+
+    async def drain(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until every submitted chunk has been answered, including chunks
+        submitted while waiting; returns False if the timeout passed first.
+        """
+        expires_at = time.monotonic() + timeout if timeout is not None else None
+        while self._active:
+            remaining = expires_at - time.monotonic() if expires_at is not None else None
+            if remaining is not None and remaining <= 0:
+                return False
+            await asyncio.wait(set(self._active), timeout=remaining)
+        return True
+
+    async def shutdown(self):
+        """Stop the pipeline and wait for the running model and postprocess calls to finish"""
+        if not self._stages:
+            return
+        for task in self._stages:
+            task.cancel()
+        self._stages = []
+        loop = asyncio.get_running_loop()
+        for stage in ("forward", "postprocess"):
+            await loop.run_in_executor(self._executors[stage], lambda: None)
+
+# Global inference scheduler instance
+inference_scheduler = InferenceScheduler()
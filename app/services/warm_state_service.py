@@ -0,0 +1,139 @@
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import torch
+
+from app.core.config import settings
+from app.services.model_service import model_service
+from app.services.near_duplicate_service import near_duplicate_cache
+from app.utils.logger import logger
+
+SNAPSHOT_NAME = "warm_state.pt"
+
+# Bumped whenever the snapshot layout changes; other formats are ignored
+SNAPSHOT_FORMAT = 1
+
+class WarmStateService:
+    """
+    Carries hot in-memory state across restarts and deploys.
+
+    On graceful shutdown the most requested near-duplicate cache entries and
+    the most used forward-pass input shapes are written to WARM_STATE_DIR.
+    On startup they are read back and the shapes prewarmed, so the first
+    requests after a rollout neither recompute repeat images nor wait for
+    kernel selection. A snapshot belongs to one model version: from another
+    model it is ignored, and with another threshold floor only its shapes
+    are used. Several workers may share the directory; each replaces the
+    snapshot atomically, so a reader never sees a partial one.
+
+    Cached detections only exist with NEAR_DUP_ENABLED; without it only the
+    shapes are restored, and the entries of a restored snapshot are written
+    back unchanged so a deploy with the cache off does not discard them.
+    """
+
+    def __init__(self):
+        self.directory = Path(settings.WARM_STATE_DIR) if settings.WARM_STATE_DIR else None
+        self.max_entries = max(settings.WARM_STATE_MAX_ENTRIES, 0)
+        self.max_shapes = max(settings.WARM_STATE_MAX_SHAPES, 0)
+        # Entries restored while the cache is disabled, with their threshold floor
+        self._carried_entries: List[Dict[str, Any]] = []
+        self._carried_floor: Optional[float] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.directory is not None
+
+    @property
+    def path(self) -> Optional[Path]:
+        return self.directory / SNAPSHOT_NAME if self.enabled else None
+
+    def _state(self) -> Dict[str, Any]:
+        if near_duplicate_cache.enabled:
+            floor, entries = near_duplicate_cache.threshold_floor, near_duplicate_cache.export(self.max_entries)
+        else:
+            floor, entries = self._carried_floor, self._carried_entries[-self.max_entries:] if self.max_entries else []
+        return {
+            "format": SNAPSHOT_FORMAT,
+            "model_version": model_service.model_version,
+            "threshold_floor": floor,
+            "created": time.time(),
+            "shapes": [
+                [batch_size, height, width, count]
+                for (batch_size, height, width), count in model_service.forward_shapes.most_common(self.max_shapes)
+            ],
+            "entries": entries
+        }
+
+    def snapshot(self) -> bool:
+        """Write the current hot state, replacing the previous snapshot; returns whether one was written"""
+        if not self.enabled or not model_service.loaded:
+            return False
+        start_time = time.perf_counter()
+        try:
+            state = self._state()
+            self.directory.mkdir(parents=True, exist_ok=True)
+            fd, staging = tempfile.mkstemp(dir=self.directory, prefix=f".{SNAPSHOT_NAME}.", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    torch.save(state, f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(staging, self.path)
+            except BaseException:
+                os.unlink(staging)
+                raise
+        except Exception as e:
+            logger.error(f"Could not write warm state to {self.path}: {str(e)}")
+            return False
+        logger.info(
+            f"Wrote warm state with {len(state['entries'])} cached images and {len(state['shapes'])} input shapes "
+            f"to {self.path} in {time.perf_counter() - start_time:.2f}s"
+        )
+        return True
+
+    def restore(self) -> bool:
+        """Load the snapshot, if it matches the loaded model, and prewarm its shapes; returns whether it was used"""
+        if not self.enabled:
+            return False
+        if not near_duplicate_cache.enabled and self.max_entries:
+            logger.info("Warm state restores input shapes only; cached detections need NEAR_DUP_ENABLED=true")
+        if not self.path.exists():
+            return False
+        try:
+            # Tensors and plain containers only, so a tampered file cannot run code
+            state = torch.load(self.path, weights_only=True)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable warm state {self.path}: {str(e)}")
+            return False
+        if not isinstance(state, dict) or state.get("format") != SNAPSHOT_FORMAT:
+            logger.warning(f"Ignoring warm state {self.path} in an unknown format")
+            return False
+        if state.get("model_version") != model_service.model_version:
+            logger.info(f"Ignoring warm state {self.path} written for {state.get('model_version')}")
+            return False
+
+        shapes = state["shapes"][:self.max_shapes]
+        for batch_size, height, width, count in shapes:
+            model_service.forward_shapes[(batch_size, height, width)] += count
+        if shapes:
+            model_service.prewarm_shapes([tuple(shape[:3]) for shape in shapes])
+
+        entries = 0
+        if not near_duplicate_cache.enabled:
+            # Kept for the next snapshot, for a later deploy with the cache on
+            self._carried_entries, self._carried_floor = state["entries"], state["threshold_floor"]
+            if state["entries"]:
+                logger.info(f"Not restoring {len(state['entries'])} cached images while NEAR_DUP_ENABLED is false")
+        elif self.max_entries:
+            if state["threshold_floor"] == near_duplicate_cache.threshold_floor:
+                entries = near_duplicate_cache.load(state["entries"][-self.max_entries:])
+            else:
+                logger.info(f"Not restoring detections cached with threshold floor {state['threshold_floor']}")
+        logger.info(f"Restored warm state from {self.path}: {entries} cached images, {len(shapes)} input shapes")
+        return True
+
+# Global warm state service instance
+warm_state_service = WarmStateService()
@@ -0,0 +1,36 @@
+import time
+from typing import Optional
+
+from app.utils.metrics import CANCELLED_WORK
+
+class RequestCancelled(Exception):
+    """Raised when nobody is waiting for a request's result any more"""
+
+class DeadlineExceeded(RequestCancelled):
+    """Raised when a request's deadline passes before its work is done"""
+
+class Deadline:
+    """Expiry time and cancellation flag shared by all stages of one request"""
+
+    def __init__(self, timeout: Optional[float] = None):
+        self.expires_at = time.monotonic() + timeout if timeout is not None else None
+        self.cancelled = False
+
+    def cancel(self):
+        """Mark the request as abandoned, e.g. after a client disconnect"""
+        self.cancelled = True
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left before the deadline, or None if there is no deadline"""
+        if self.expires_at is None:
+            return None
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def check(self, stage: str):
+        """Raise if the work about to start at this stage is no longer wanted"""
+        if self.cancelled:
+            CANCELLED_WORK.labels(reason="disconnect", stage=stage).inc()
+            raise RequestCancelled(f"Request cancelled before {stage}")
+        if self.expires_at is not None and time.monotonic() >= self.expires_at:
+            CANCELLED_WORK.labels(reason="deadline", stage=stage).inc()
+            raise DeadlineExceeded(f"Request deadline exceeded before {stage}")
@@ -1,10 +1,18 @@
 from PIL import Image, ImageDraw, ImageFont
 import io
+import math
 import base64
 from typing import List, Dict, Any, Optional, Tuple
 import numpy as np
 import cv2
 
+# Orthonormal DCT-II basis used by the perceptual hash
+_HASH_SIZE = 32
+_HASH_DCT = np.cos(
+    np.pi * (2 * np.arange(_HASH_SIZE)[None, :] + 1) * np.arange(_HASH_SIZE)[:, None] / (2 * _HASH_SIZE)
+).astype(np.float32) * np.sqrt(2 / _HASH_SIZE)
+_HASH_DCT[0] /= np.sqrt(2)
+
 class ImageProcessor:
     """Utility class for image processing operations"""
     
@@ -18,14 +26,94 @@ class ImageProcessor:
         except (IOError, SyntaxError):
             return False
     
+    @staticmethod
+    def peek_size(image_bytes: bytes) -> Optional[Tuple[int, int]]:
+        """Read (width, height) from the image header without decoding the pixels"""
+        try:
+            with Image.open(io.BytesIO(image_bytes)) as image:
+                return image.size
+        except Exception:
+            return None
+    
     @staticmethod
     def convert_to_rgb(image_bytes: bytes) -> Image.Image:
         """Convert image bytes to RGB PIL Image"""
         image = Image.open(io.BytesIO(image_bytes))
         if image.mode != 'RGB':
             image = image.convert('RGB')
+        else:
+            # Decode now rather than lazily on first pixel access
+            image.load()
         return image
     
+    @staticmethod
+    def frames_from_raw(buffer: bytes, width: int, height: int) -> np.ndarray:
+        """View packed RGB bytes as (frames, height, width, 3) uint8 without copying"""
+        frame_bytes = width * height * 3
+        if not buffer or len(buffer) % frame_bytes:
+            raise ValueError(
+                f"Body of {len(buffer)} bytes is not a whole number of {width}x{height} RGB frames "
+                f"({frame_bytes} bytes each)"
+            )
+        return np.frombuffer(buffer, dtype=np.uint8).reshape(-1, height, width, 3)
+    
+    @staticmethod
+    def frames_from_npy(buffer: bytes) -> np.ndarray:
+        """View a .npy payload of uint8 RGB frames as (frames, height, width, 3) without copying"""
+        stream = io.BytesIO(buffer)
+        try:
+            version = np.lib.format.read_magic(stream)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(stream)
+            elif version == (2, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(stream)
+            else:
+                raise ValueError(f"unsupported format version {version}")
+        except ValueError as e:
+            raise ValueError(f"Invalid .npy payload: {e}")
+        
+        if dtype != np.uint8 or fortran_order:
+            raise ValueError(f"Expected a C-ordered uint8 array, got {'Fortran-ordered ' if fortran_order else ''}{dtype}")
+        if len(shape) == 3:
+            shape = (1, *shape)
+        if len(shape) != 4 or shape[3] != 3 or 0 in shape:
+            raise ValueError(f"Expected shape (height, width, 3) or (frames, height, width, 3), got {shape}")
+        
+        count = int(np.prod(shape))
+        offset = stream.tell()
+        if len(buffer) - offset != count:
+            raise ValueError(f"Payload holds {len(buffer) - offset} bytes of pixels but shape {shape} needs {count}")
+        return np.frombuffer(buffer, dtype=np.uint8, count=count, offset=offset).reshape(shape)
+    
+    @staticmethod
+    def open_hash_thumbnail(image_bytes: bytes) -> Optional[Tuple[Image.Image, Tuple[int, int]]]:
+        """
+        Decode a small grayscale version of a JPEG for perceptual hashing.
+        
+        JPEG draft mode decodes at 1/8 scale from the DCT coefficients, which
+        is far cheaper than a full decode. Returns (thumbnail, original size),
+        or None for formats without a reduced-size decode.
+        """
+        try:
+            image = Image.open(io.BytesIO(image_bytes))
+            if image.format != "JPEG":
+                return None
+            size = image.size
+            image.draft("L", (64, 64))
+            return image.convert("L"), size
+        except (IOError, SyntaxError):
+            return None
+    
+    @staticmethod
+    def perceptual_hash(image: Image.Image) -> int:
+        """64-bit DCT perceptual hash, stable under resizing and recompression"""
+        # Shrink before the grayscale conversion so it only touches the thumbnail
+        thumbnail = image.resize((_HASH_SIZE, _HASH_SIZE), Image.Resampling.BOX).convert("L")
+        pixels = np.asarray(thumbnail, dtype=np.float32)
+        low_frequencies = (_HASH_DCT @ pixels @ _HASH_DCT.T)[:8, :8].ravel()
+        bits = low_frequencies > np.median(low_frequencies)
+        return int.from_bytes(np.packbits(bits).tobytes(), "big")
+    
     @staticmethod
     def resize_image(image: Image.Image, max_size: Tuple[int, int] = (1024, 1024)) -> Image.Image:
         """Resize image while maintaining aspect ratio"""
@@ -113,7 +201,41 @@ class ImageProcessor:
     @staticmethod
     def create_thumbnail(image: Image.Image, size: Tuple[int, int] = (200, 200)) -> Image.Image:
         """Create a thumbnail of the image"""
-        return image.copy().thumbnail(size, Image.Resampling.LANCZOS)
+        # Image.thumbnail resizes in place and returns None
+        thumbnail = image.copy()
+        thumbnail.thumbnail(size, Image.Resampling.LANCZOS)
+        return thumbnail
+    
+    @staticmethod
+    def crop_box(
+        image: Image.Image,
+        bbox: Dict[str, float],
+        padding: float = 0.0,
+        max_size: Optional[int] = None
+    ) -> Image.Image:
+        """Crop a bounding box plus padding (a fraction of its size), optionally fit within max_size"""
+        pad_x = (bbox["xmax"] - bbox["xmin"]) * padding
+        pad_y = (bbox["ymax"] - bbox["ymin"]) * padding
+        left = min(max(int(bbox["xmin"] - pad_x), 0), image.width - 1)
+        top = min(max(int(bbox["ymin"] - pad_y), 0), image.height - 1)
+        right = max(min(math.ceil(bbox["xmax"] + pad_x), image.width), left + 1)
+        bottom = max(min(math.ceil(bbox["ymax"] + pad_y), image.height), top + 1)
+        
+        crop = image.crop((left, top, right, bottom))
+        if max_size is not None:
+            # The crop is a new image, so it can be resized in place
+            crop.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+        return crop
+    
+    @staticmethod
+    def encode_image(image: Image.Image, format: str = "JPEG", quality: int = 90) -> bytes:
+        """Encode a PIL Image to bytes"""
+        buffered = io.BytesIO()
+        if format in ("JPEG", "WEBP"):
+            image.save(buffered, format=format, quality=quality)
+        else:
+            image.save(buffered, format=format)
+        return buffered.getvalue()
 
 # Global image processor instance
 image_processor = ImageProcessor()
\ No newline at end of file
@@ -1,25 +1,107 @@
+import atexit
+import json
 import logging
+import logging.handlers
+import queue
+import random
 import sys
+from datetime import datetime, timezone
+from typing import Dict
+
 from app.core.config import settings
+from app.utils.metrics import LOG_RECORDS_DROPPED
+from app.utils.tracing import get_request_id
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "high_volume"}
+
+_HANDLER_NAME = "omni-queue"
+
+class ContextFilter(logging.Filter):
+    """Sample high-volume records per level and attach the current request id"""
+
+    def __init__(self, sample_rates: Dict[str, float]):
+        super().__init__()
+        self.sample_rates = {logging.getLevelName(level.upper()): rate for level, rate in sample_rates.items()}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        # Only records logged with extra={"high_volume": True} are sampled
+        if getattr(record, "high_volume", False):
+            rate = self.sample_rates.get(record.levelno, 1.0)
+            if rate < 1.0 and random.random() >= rate:
+                return False
+        if not hasattr(record, "request_id"):
+            # Context variables are only visible here, not in the writer thread
+            record.request_id = get_request_id()
+        return True
+
+class JSONFormatter(logging.Formatter):
+    """Format records as one JSON object per line"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "model": settings.MODEL_ARTIFACT_DIR or settings.MODEL_CHECKPOINT
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to a writer thread, dropping them rather than blocking when it falls behind"""
+
+    def __init__(self, log_queue: queue.Queue, stream_handler: logging.Handler):
+        super().__init__(log_queue)
+        self.listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Records never leave the process, so message formatting is left to the writer thread
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
 
 def setup_logger():
     """Setup application logger"""
     logger = logging.getLogger(settings.APP_NAME)
-    logger.setLevel(logging.DEBUG if settings.DEBUG else logging.INFO)
-    
-    # Create console handler
-    handler = logging.StreamHandler(sys.stdout)
-    handler.setLevel(logging.DEBUG if settings.DEBUG else logging.INFO)
-    
-    # Create formatter
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
-    handler.setFormatter(formatter)
-    
-    # Add handler to logger
+    level = logging.DEBUG if settings.DEBUG else logging.INFO
+    logger.setLevel(level)
+    logger.propagate = False
+
+    # Replace the handler from a previous setup (e.g. a module reload) instead of
+    # adding another; matched by name since a reload redefines the handler class
+    for existing in list(logger.handlers):
+        if existing.get_name() == _HANDLER_NAME:
+            existing.listener.stop()
+            atexit.unregister(existing.listener.stop)
+            logger.removeHandler(existing)
+
+    # Console handler, run by the writer thread
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setLevel(level)
+    if settings.LOG_FORMAT == "json":
+        stream_handler.setFormatter(JSONFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter(
+            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+        ))
+
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=settings.LOG_QUEUE_SIZE), stream_handler)
+    handler.set_name(_HANDLER_NAME)
+    handler.addFilter(ContextFilter(settings.LOG_SAMPLE_RATES))
+    handler.listener.start()
+    atexit.register(handler.listener.stop)
     logger.addHandler(handler)
-    
+
     return logger
 
-logger = setup_logger()
\ No newline at end of file
+logger = setup_logger()
@@ -0,0 +1,227 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+
+from prometheus_client import Counter, Gauge, Histogram
+
+from app.utils.tracing import get_current_trace
+
+# Stage latencies span sub-millisecond decode work up to multi-second forwards
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+# With several workers every process writes its metrics under
+# PROMETHEUS_MULTIPROC_DIR; each gauge's multiprocess_mode says how they are
+# combined: levels are summed over live workers, per-worker settings take
+# the max, and per-process values keep a pid label
+
+# Pipeline stages, in request order
+STAGES = ("upload_read", "fingerprint", "decode", "preprocess", "forward", "postprocess", "crop", "serialize")
+
+STAGE_LATENCY = Histogram(
+    "omni_stage_latency_seconds",
+    "Latency of each detection pipeline stage",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+
+# Export every stage from the start, so dashboards see zeros rather than missing series
+for _stage in STAGES:
+    STAGE_LATENCY.labels(stage=_stage)
+
+REQUEST_LATENCY = Histogram(
+    "omni_request_latency_seconds",
+    "End-to-end HTTP request latency",
+    ["route"],
+    buckets=LATENCY_BUCKETS,
+)
+
+IN_FLIGHT = Gauge(
+    "omni_requests_in_flight",
+    "HTTP requests currently being processed",
+    multiprocess_mode="livesum",
+)
+
+QUEUE_DEPTH = Gauge(
+    "omni_inference_queue_depth",
+    "Images waiting to be dispatched to the model",
+    ["priority"],
+    multiprocess_mode="livesum",
+)
+
+QUEUE_WAIT = Histogram(
+    "omni_inference_queue_wait_seconds",
+    "Time a chunk of work waited before being dispatched to the model",
+    ["priority"],
+    buckets=LATENCY_BUCKETS,
+)
+
+DISPATCHED_IMAGES = Counter(
+    "omni_inference_dispatched_images_total",
+    "Images dispatched to the model",
+    ["priority"],
+)
+
+BATCH_SIZE = Histogram(
+    "omni_batch_size",
+    "Number of images per model forward pass",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+
+PIPELINE_BUSY_SECONDS = Counter(
+    "omni_pipeline_busy_seconds",
+    "Time spent running each inference pipeline stage; its rate over omni_pipeline_workers is the stage's utilization",
+    ["stage"],
+)
+
+PIPELINE_WORKERS = Gauge(
+    "omni_pipeline_workers",
+    "Threads serving each inference pipeline stage",
+    ["stage"],
+    multiprocess_mode="livesum",
+)
+
+PIPELINE_QUEUE_DEPTH = Gauge(
+    "omni_pipeline_queue_depth",
+    "Batches waiting between inference pipeline stages",
+    ["queue"],
+    multiprocess_mode="livesum",
+)
+
+CANCELLED_WORK = Counter(
+    "omni_cancelled_work_total",
+    "Work dropped because its deadline passed or its client went away",
+    ["reason", "stage"],
+)
+
+CACHE_REQUESTS = Counter(
+    "omni_cache_requests_total",
+    "Cache lookups by cache name and result",
+    ["cache", "result"],
+)
+
+CACHE_HIT_RATIO = Gauge(
+    "omni_cache_hit_ratio",
+    "Fraction of cache lookups that were hits since startup",
+    ["cache"],
+    multiprocess_mode="liveall",
+)
+
+NEAR_DUP_DISTANCE = Histogram(
+    "omni_near_duplicate_distance_bits",
+    "Hamming distance between an upload's perceptual hash and the cached image it reused",
+    buckets=(0, 1, 2, 4, 6, 8, 12, 16, 24, 32),
+)
+
+NEAR_DUP_MAX_DISTANCE = Gauge(
+    "omni_near_duplicate_max_distance_bits",
+    "Largest perceptual hash distance accepted as a near duplicate",
+    multiprocess_mode="livemax",
+)
+
+NEAR_DUP_ENTRIES = Gauge(
+    "omni_near_duplicate_entries",
+    "Images held in the near-duplicate cache",
+    multiprocess_mode="livesum",
+)
+
+SHAPE_BUCKET_IMAGES = Counter(
+    "omni_shape_bucket_images_total",
+    "Images by the shape bucket their batch was padded to, 'none' when no bucket fits",
+    ["bucket"],
+)
+
+PADDING_WASTE = Histogram(
+    "omni_padding_waste_ratio",
+    "Fraction of each forward pass's input pixels that are padding",
+    buckets=(0.0, 0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.8, 1.0),
+)
+
+RATE_LIMITED = Counter(
+    "omni_rate_limited_requests_total",
+    "Requests rejected with 429 by per-client limits",
+    ["reason"],
+)
+
+MEMORY_BUDGET = Gauge(
+    "omni_memory_budget_bytes",
+    "Decoded-image memory that admitted requests may hold at once",
+    multiprocess_mode="livesum",
+)
+
+MEMORY_RESERVED = Gauge(
+    "omni_memory_reserved_bytes",
+    "Estimated decoded-image memory held by admitted requests",
+    multiprocess_mode="livesum",
+)
+
+ADMISSION_WAITING = Gauge(
+    "omni_admission_waiting_requests",
+    "Requests waiting for memory budget before decoding",
+    multiprocess_mode="livesum",
+)
+
+ADMISSION_WAIT = Histogram(
+    "omni_admission_wait_seconds",
+    "Time a request waited for memory budget",
+    buckets=LATENCY_BUCKETS,
+)
+
+LOG_RECORDS_DROPPED = Counter(
+    "omni_log_records_dropped_total",
+    "Log records dropped because the log writer fell behind",
+)
+
+MODEL_LOAD_SECONDS = Gauge(
+    "omni_model_load_seconds",
+    "Time taken to load the model at startup",
+    multiprocess_mode="livemax",
+)
+
+MODEL_MEMORY = Gauge(
+    "omni_model_memory_bytes",
+    "Memory held by the model",
+    ["kind"],
+    multiprocess_mode="liveall",
+)
+
+# Hit/miss tallies per cache, used to keep CACHE_HIT_RATIO current
+_cache_counts: Dict[str, List[int]] = defaultdict(lambda: [0, 0])
+
+# Labelled children per cache, since resolving labels costs more than the update
+_cache_metrics: Dict[str, tuple] = {}
+
+@contextmanager
+def timed_stage(stage: str) -> Iterator[None]:
+    """Record the duration of a pipeline stage using a monotonic clock"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        STAGE_LATENCY.labels(stage=stage).observe(duration)
+        trace = get_current_trace()
+        if trace is not None:
+            trace.add_span(stage, start, duration)
+
+def record_cache_lookup(cache: str, hit: bool):
+    """Count a cache lookup and refresh the cache's hit ratio"""
+    children = _cache_metrics.get(cache)
+    if children is None:
+        children = _cache_metrics[cache] = (
+            CACHE_REQUESTS.labels(cache=cache, result="hit"),
+            CACHE_REQUESTS.labels(cache=cache, result="miss"),
+            CACHE_HIT_RATIO.labels(cache=cache)
+        )
+    children[0 if hit else 1].inc()
+    counts = _cache_counts[cache]
+    counts[0 if hit else 1] += 1
+    children[2].set(counts[0] / (counts[0] + counts[1]))
+
+def cache_counts(cache: str) -> Dict[str, int]:
+    """Hits and misses recorded for a cache since startup"""
+    hits, misses = _cache_counts[cache]
+    return {"hits": hits, "misses": misses}
@@ -0,0 +1,110 @@
+import hashlib
+import json
+import mmap
+import struct
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import torch
+
+from app.utils.logger import logger
+
+MANIFEST_NAME = "manifest.json"
+WEIGHTS_NAME = "model.safetensors"
+
+# safetensors dtype codes
+_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+class ArtifactError(RuntimeError):
+    """A model artifact directory is missing files or fails verification"""
+
+def file_sha256(path: Path) -> str:
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+def write_manifest(artifact_dir: Path, source: str, revision: Optional[str] = None) -> Dict[str, Any]:
+    """Record the source checkpoint and the checksum, size and mtime of every file in the directory"""
+    files = {
+        path.name: {"sha256": file_sha256(path), "size": path.stat().st_size, "mtime_ns": path.stat().st_mtime_ns}
+        for path in sorted(artifact_dir.iterdir())
+        if path.is_file() and path.name != MANIFEST_NAME
+    }
+    manifest = {
+        "source": source,
+        "revision": revision,
+        "created": datetime.now(timezone.utc).isoformat(),
+        "torch": torch.__version__,
+        "files": files
+    }
+    (artifact_dir / MANIFEST_NAME).write_text(json.dumps(manifest, indent=2) + "\n")
+    return manifest
+
+def verify_manifest(artifact_dir: Path, checksums: bool = False) -> Dict[str, Any]:
+    """
+    Check every file listed in the manifest exists with the recorded size.
+
+    Checksums were computed at export, so a file keeping its recorded mtime
+    is not hashed again unless checksums is set; one whose mtime changed
+    (or from a manifest without mtimes) is hashed to prove it is unmodified.
+    """
+    manifest_path = artifact_dir / MANIFEST_NAME
+    if not manifest_path.is_file():
+        raise ArtifactError(f"No {MANIFEST_NAME} in {artifact_dir}; run `python -m app.cli export-model`")
+    manifest = json.loads(manifest_path.read_text())
+    if WEIGHTS_NAME not in manifest["files"]:
+        raise ArtifactError(f"{artifact_dir} has no {WEIGHTS_NAME}")
+
+    for name, expected in manifest["files"].items():
+        path = artifact_dir / name
+        if not path.is_file():
+            raise ArtifactError(f"Artifact file {path} is missing")
+        stat = path.stat()
+        if stat.st_size != expected["size"]:
+            raise ArtifactError(f"Artifact file {path} has size {stat.st_size}, expected {expected['size']}")
+        unchanged = stat.st_mtime_ns == expected.get("mtime_ns")
+        if checksums or not unchanged:
+            if not unchanged:
+                logger.info(f"Artifact file {path} was modified after export; verifying its checksum")
+            if file_sha256(path) != expected["sha256"]:
+                raise ArtifactError(f"Artifact file {path} does not match its checksum")
+    return manifest
+
+def mmap_safetensors(path: Path) -> Tuple[Dict[str, torch.Tensor], mmap.mmap]:
+    """
+    Map a safetensors file into memory and return tensors that view it.
+
+    The mapping is copy-on-write over the page cache, so processes loading
+    the same file share its physical pages and nothing is read until used.
+    Tensors whose offset is not aligned to their dtype are copied instead.
+    The mmap is returned so the caller can keep it alive with the tensors.
+    """
+    with open(path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    header_size = struct.unpack("<Q", buffer[:8])[0]
+    header = json.loads(buffer[8:8 + header_size])
+    header.pop("__metadata__", None)
+    data = torch.frombuffer(buffer, dtype=torch.uint8)[8 + header_size:]
+
+    tensors = {}
+    for name, info in header.items():
+        dtype = _DTYPES.get(info["dtype"])
+        if dtype is None:
+            raise ArtifactError(f"Unsupported dtype {info['dtype']} for {name} in {path}")
+        start, end = info["data_offsets"]
+        raw = data[start:end]
+        if (8 + header_size + start) % dtype.itemsize:
+            raw = raw.clone()
+        tensors[name] = raw.view(dtype).reshape(info["shape"])
+    return tensors, buffer
@@ -0,0 +1,84 @@
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+import orjson
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel
+
+from app.utils.metrics import timed_stage
+
+try:
+    import msgpack
+except ImportError:  # MessagePack is optional; clients asking for it get JSON
+    msgpack = None
+
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack")
+
+_ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+def _default(obj: Any) -> Any:
+    """Encode values neither orjson nor msgpack handle natively"""
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json")
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    raise TypeError(f"Type is not serializable: {type(obj).__name__}")
+
+def dumps_json(content: Any) -> bytes:
+    """Encode content as compact JSON"""
+    return orjson.dumps(content, default=_default, option=_ORJSON_OPTIONS)
+
+class FastJSONResponse(JSONResponse):
+    """JSON response rendered with orjson, timed as the serialize stage"""
+
+    def render(self, content: Any) -> bytes:
+        with timed_stage("serialize"):
+            return dumps_json(content)
+
+class MsgPackResponse(Response):
+    """MessagePack response, timed as the serialize stage"""
+
+    media_type = "application/msgpack"
+
+    def render(self, content: Any) -> bytes:
+        with timed_stage("serialize"):
+            return msgpack.packb(content, default=_default, use_bin_type=True)
+
+def _accept_quality(accept: str) -> Dict[str, float]:
+    """Map each media type in an Accept header to its quality"""
+    qualities = {}
+    for entry in accept.split(","):
+        media_type, *params = (part.strip() for part in entry.split(";"))
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if media_type:
+            qualities[media_type.lower()] = quality
+    return qualities
+
+def wants_msgpack(accept: Optional[str]) -> bool:
+    """Whether an Accept header prefers MessagePack over JSON"""
+    if msgpack is None or not accept:
+        return False
+    qualities = _accept_quality(accept)
+    msgpack_quality = max(qualities.get(media_type, 0.0) for media_type in MSGPACK_MEDIA_TYPES)
+    # Naming MessagePack outranks wildcards; an equally preferred application/json still wins
+    return msgpack_quality > qualities.get("application/json", 0.0)
+
+def negotiated_response(content: Any, accept: Optional[str], status_code: int = 200) -> Response:
+    """
+    Render already validated content as MessagePack when the client asks for
+    it, and as JSON otherwise.
+
+    Content is encoded as is, so routes returning this skip FastAPI's
+    response_model validation of data the service built itself.
+    """
+    response_class = MsgPackResponse if wants_msgpack(accept) else FastJSONResponse
+    return response_class(content=content, status_code=status_code, headers={"Vary": "Accept"})
@@ -0,0 +1,65 @@
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+class RequestTrace:
+    """Stage spans recorded for a single request"""
+
+    def __init__(self, route: str, request_id: Optional[str] = None, sampled: bool = False):
+        self.route = route
+        self.request_id = request_id
+        # Sampled traces are persisted; all traces feed the request's log record
+        self.sampled = sampled
+        self.timestamp = time.time()
+        self.start = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+
+    def add_span(self, stage: str, start: float, duration: float):
+        """Record a stage span relative to the start of the request"""
+        self.spans.append({
+            "stage": stage,
+            "start_ms": round((start - self.start) * 1000, 3),
+            "duration_ms": round(duration * 1000, 3)
+        })
+
+    def elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self.start) * 1000, 3)
+
+    def stage_durations(self) -> Dict[str, float]:
+        """Total milliseconds spent in each stage"""
+        durations: Dict[str, float] = {}
+        for span in self.spans:
+            durations[span["stage"]] = round(durations.get(span["stage"], 0.0) + span["duration_ms"], 3)
+        return durations
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert the trace into a JSON-serializable dict"""
+        return {
+            "route": self.route,
+            "request_id": self.request_id,
+            "timestamp": self.timestamp,
+            "total_ms": self.elapsed_ms(),
+            "spans": self.spans
+        }
+
+# Identifier of the HTTP request being handled in the current context
+_current_request_id: ContextVar[Optional[str]] = ContextVar("current_request_id", default=None)
+
+def get_request_id() -> Optional[str]:
+    """Return the id of the current request, if any"""
+    return _current_request_id.get()
+
+def set_request_id(request_id: Optional[str]):
+    """Attach a request id to the current context"""
+    _current_request_id.set(request_id)
+
+# Trace of the request being handled in the current context, if any
+_current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("current_trace", default=None)
+
+def get_current_trace() -> Optional[RequestTrace]:
+    """Return the trace of the current request, if any"""
+    return _current_trace.get()
+
+def set_current_trace(trace: Optional[RequestTrace]):
+    """Attach a trace to the current request context"""
+    _current_trace.set(trace)
@@ -0,0 +1,101 @@
+"""
+Offline benchmarks for the detection pipeline.
+
+    python -m benchmarks all --output bench_results.json
+    python -m benchmarks load --concurrency 1 4 16 --requests 200
+    python -m benchmarks memory --memory-budget-mb 256
+    python -m benchmarks all --update-baseline
+
+By default the app runs against a small randomly initialized model built
+from benchmarks/tiny_model, so no Hub access is needed. Pass --real-model
+to benchmark MODEL_CHECKPOINT instead.
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+from benchmarks.common import (
+    BASELINE_PATH,
+    compare_to_baseline,
+    configure_environment,
+    environment_info,
+    load_benchmark_images,
+    write_results,
+)
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("suite", choices=["micro", "load", "memory", "all"], help="Benchmarks to run")
+    parser.add_argument("--real-model", action="store_true", help="Use MODEL_CHECKPOINT instead of the tiny model")
+    parser.add_argument("--iterations", type=int, default=10, help="Timed iterations per microbenchmark")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="Load-test concurrency levels")
+    parser.add_argument("--requests", type=int, default=50, help="Requests per concurrency level")
+    parser.add_argument("--route", choices=["image", "batch"], default="image", help="Detection route to load")
+    parser.add_argument("--batch-size", type=int, default=4, help="Images per request for the batch route")
+    parser.add_argument("--memory-budget-mb", type=int, default=256, help="MEMORY_BUDGET_MB for the memory suite")
+    parser.add_argument("--batch-budget-mb", type=int, default=128, help="MEMORY_BATCH_BUDGET_MB for the memory suite")
+    parser.add_argument("--output", type=Path, default=Path("bench_output.json"), help="Where to write results")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH, help="Baseline to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative regression")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="Ignore latency changes below this")
+    parser.add_argument("--update-baseline", action="store_true", help="Overwrite the baseline with these results")
+    return parser.parse_args(argv)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    output = args.output.resolve()
+    baseline_path = args.baseline.resolve()
+    configure_environment(tiny=not args.real_model)
+
+    # Imported after configure_environment so the app sees the benchmark settings
+    from benchmarks.load import run_load
+    from benchmarks.memory import run_memory
+    from benchmarks.micro import run_micro
+
+    images = load_benchmark_images()
+    results = {"environment": environment_info()}
+    if args.suite in ("micro", "all"):
+        results["micro"] = run_micro(images, iterations=args.iterations)
+    if args.suite in ("load", "all"):
+        results["load"] = run_load(
+            images, args.concurrency, total_requests=args.requests,
+            route=args.route, batch_size=args.batch_size
+        )
+    if args.suite in ("memory", "all"):
+        # The memory suite always drives the batch route, at the highest concurrency
+        results["memory"] = run_memory(
+            images, max(args.concurrency), total_requests=args.requests, batch_size=args.batch_size,
+            budget_mb=args.memory_budget_mb, batch_budget_mb=args.batch_budget_mb
+        )
+    write_results(results, output)
+    print(f"Results written to {output}")
+
+    if args.update_baseline:
+        write_results(results, baseline_path)
+        print(f"Baseline updated at {baseline_path}")
+        return 0
+
+    failures = [
+        f"{section}/{case}: {metrics['errors']} failed requests"
+        for section in ("load", "memory")
+        for case, metrics in results.get(section, {}).items() if metrics["errors"]
+    ]
+    if baseline_path.exists():
+        baseline = json.loads(baseline_path.read_text())
+        failures += compare_to_baseline(results, baseline, args.tolerance, args.min_delta_ms)
+    else:
+        print(f"No baseline at {baseline_path}; skipping comparison")
+
+    if failures:
+        print(f"PERFORMANCE REGRESSION ({len(failures)} metrics beyond {args.tolerance:.0%} tolerance):",
+              file=sys.stderr)
+        for failure in failures:
+            print(f"  {failure}", file=sys.stderr)
+        return 1
+    print("No regressions against baseline")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
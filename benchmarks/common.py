@@ -0,0 +1,149 @@
+import io
+import json
+import os
+import platform
+import statistics
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+REPO_ROOT = BENCHMARK_DIR.parent
+TINY_MODEL_CONFIG_DIR = BENCHMARK_DIR / "tiny_model"
+TINY_MODEL_CACHE_DIR = BENCHMARK_DIR / ".cache" / "tiny-model"
+EXAMPLES_DIR = REPO_ROOT / "static" / "examples"
+BASELINE_PATH = BENCHMARK_DIR / "baseline.json"
+
+# Synthetic image sizes (width, height) covering thumbnails to full-HD photos
+SYNTHETIC_SIZES = [(320, 240), (640, 480), (1280, 960), (1920, 1080)]
+
+def build_tiny_model(output_dir: Path = TINY_MODEL_CACHE_DIR) -> Path:
+    """Create a small randomly initialized detection model from the local config"""
+    import torch
+    from transformers import AutoConfig, AutoImageProcessor, AutoModelForObjectDetection
+
+    if (output_dir / "config.json").exists():
+        return output_dir
+    torch.manual_seed(0)
+    config = AutoConfig.from_pretrained(TINY_MODEL_CONFIG_DIR)
+    model = AutoModelForObjectDetection.from_config(config)
+    processor = AutoImageProcessor.from_pretrained(TINY_MODEL_CONFIG_DIR)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    model.save_pretrained(output_dir)
+    processor.save_pretrained(output_dir)
+    return output_dir
+
+def configure_environment(tiny: bool = True):
+    """Point the app at a usable configuration before it is imported"""
+    if tiny:
+        os.environ["MODEL_CHECKPOINT"] = str(build_tiny_model())
+        os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    os.environ.setdefault("API_PREFIX", "/api/v1")
+    os.environ.setdefault("ALGORITHM", "HS256")
+    os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+    os.chdir(REPO_ROOT)
+
+def synthetic_image(width: int, height: int, seed: int = 0) -> Image.Image:
+    """Create a textured RGB image that does not compress unrealistically well"""
+    rng = np.random.default_rng(seed)
+    gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+    noise = rng.normal(0, 40, size=(height, width, 3))
+    pixels = np.clip(gradient + noise, 0, 255).astype(np.uint8)
+    return Image.fromarray(pixels, mode="RGB")
+
+def encode_image(image: Image.Image, format: str = "JPEG") -> bytes:
+    """Encode a PIL image to bytes"""
+    buffer = io.BytesIO()
+    if format == "JPEG":
+        image.save(buffer, format=format, quality=90)
+    else:
+        image.save(buffer, format=format)
+    return buffer.getvalue()
+
+def load_benchmark_images() -> List[Tuple[str, bytes]]:
+    """Return (name, encoded bytes) for the bundled examples and synthetic sizes"""
+    images = [(path.name, path.read_bytes()) for path in sorted(EXAMPLES_DIR.glob("*.png"))]
+    for width, height in SYNTHETIC_SIZES:
+        images.append((f"synthetic_{width}x{height}.jpg", encode_image(synthetic_image(width, height))))
+    return images
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """Summarize latency samples (seconds) as milliseconds"""
+    ordered = sorted(samples)
+
+    def percentile(p: float) -> float:
+        index = min(int(round(p / 100 * (len(ordered) - 1))), len(ordered) - 1)
+        return ordered[index] * 1000
+
+    return {
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "p50_ms": round(percentile(50), 3),
+        "p95_ms": round(percentile(95), 3),
+        "p99_ms": round(percentile(99), 3)
+    }
+
+def environment_info() -> Dict[str, Any]:
+    """Describe the machine and library versions a result was produced on"""
+    import torch
+    import transformers
+
+    checkpoint = os.environ.get("MODEL_CHECKPOINT")
+    if checkpoint and Path(checkpoint).is_relative_to(REPO_ROOT):
+        checkpoint = str(Path(checkpoint).relative_to(REPO_ROOT))
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "torch": torch.__version__,
+        "torch_threads": torch.get_num_threads(),
+        "transformers": transformers.__version__,
+        "model_checkpoint": checkpoint
+    }
+
+def write_results(results: Dict[str, Any], path: Path):
+    """Write benchmark results as JSON"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(results, indent=2, sort_keys=True) + "\n")
+
+def compare_to_baseline(
+    results: Dict[str, Any],
+    baseline: Dict[str, Any],
+    tolerance: float,
+    min_delta_ms: float = 1.0
+) -> List[str]:
+    """
+    Compare results against a baseline and describe every regression.
+
+    Metrics ending in ``_ms`` or ``_bytes`` regress when they grow, metrics
+    ending in ``_rps`` regress when they shrink, beyond the relative tolerance.
+    Latency changes smaller than ``min_delta_ms`` are treated as noise.
+    Metrics missing from either side are ignored.
+    """
+    regressions = []
+    for section, cases in baseline.items():
+        if section == "environment":
+            continue
+        for case, metrics in cases.items():
+            current = results.get(section, {}).get(case)
+            if current is None:
+                continue
+            for metric, expected in metrics.items():
+                actual = current.get(metric)
+                if actual is None or not expected:
+                    continue
+                if metric.endswith("_ms"):
+                    regressed = actual - expected > max(expected * tolerance, min_delta_ms)
+                elif metric.endswith("_bytes"):
+                    regressed = actual > expected * (1 + tolerance)
+                elif metric.endswith("_rps"):
+                    regressed = actual < expected * (1 - tolerance)
+                else:
+                    continue
+                if regressed:
+                    regressions.append(
+                        f"{section}/{case}/{metric}: {actual} vs baseline {expected} "
+                        f"({(actual - expected) / expected:+.1%})"
+                    )
+    return regressions
@@ -0,0 +1,82 @@
+import asyncio
+import time
+from typing import Any, Dict, List, Tuple
+
+from benchmarks.common import summarize
+
+async def _run_load(
+    images: List[Tuple[str, bytes]],
+    concurrency: int,
+    total_requests: int,
+    route: str,
+    batch_size: int
+) -> Dict[str, Any]:
+    import httpx
+    from prometheus_client import REGISTRY
+
+    from app.core.config import settings
+    from app.core.security import create_access_token
+    from app.main import app
+
+    token = create_access_token(data={"sub": "benchmark"})
+    url = f"{settings.API_PREFIX}/detect/{route}"
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(total_requests))
+
+    def busy_seconds(stage: str) -> float:
+        return REGISTRY.get_sample_value("omni_pipeline_busy_seconds_total", {"stage": stage}) or 0.0
+
+    def build_files(index: int):
+        if route == "batch":
+            return [
+                ("files", (name, data, "image/jpeg"))
+                for name, data in (images[(index + i) % len(images)] for i in range(batch_size))
+            ]
+        name, data = images[index % len(images)]
+        return {"file": (name, data, "image/jpeg")}
+
+    async def worker(client: httpx.AsyncClient):
+        nonlocal errors
+        for index in counter:
+            start = time.perf_counter()
+            response = await client.post(url, files=build_files(index), headers={"X-Token": token})
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors += 1
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        # Warm up the model and the route before measuring
+        await client.post(url, files=build_files(0), headers={"X-Token": token})
+        forward_busy = busy_seconds("forward")
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        forward_busy = busy_seconds("forward") - forward_busy
+
+    images_per_request = batch_size if route == "batch" else 1
+    return {
+        **summarize(latencies),
+        "throughput_rps": round(total_requests / elapsed, 3),
+        "images_per_second_rps": round(total_requests * images_per_request / elapsed, 3),
+        # Fraction of the run the model spent in forward passes; near 1 means inference bound
+        "forward_utilization": round(forward_busy / elapsed, 3),
+        "requests": total_requests,
+        "errors": errors
+    }
+
+def run_load(
+    images: List[Tuple[str, bytes]],
+    concurrency_levels: List[int],
+    total_requests: int = 50,
+    route: str = "image",
+    batch_size: int = 4
+) -> Dict[str, Dict[str, Any]]:
+    """Drive the FastAPI app in-process at each concurrency level"""
+    results = {}
+    for concurrency in concurrency_levels:
+        results[f"{route}/concurrency_{concurrency}"] = asyncio.run(
+            _run_load(images, concurrency, total_requests, route, batch_size)
+        )
+    return results
@@ -0,0 +1,127 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Any, Dict, List, Optional, Tuple
+
+from benchmarks.common import summarize
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+def _rss_bytes() -> int:
+    """Resident set size of this process (Linux)"""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * _PAGE_SIZE
+
+class _PeakRss(threading.Thread):
+    """Sample the resident set size in the background and keep the peak"""
+
+    def __init__(self, interval: float = 0.005):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = _rss_bytes()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.peak = max(self.peak, _rss_bytes())
+            time.sleep(self.interval)
+
+    def stop(self) -> int:
+        self._stop_event.set()
+        self.join()
+        return max(self.peak, _rss_bytes())
+
+async def _run_case(
+    images: List[Tuple[str, bytes]],
+    concurrency: int,
+    total_requests: int,
+    batch_size: int
+) -> Dict[str, Any]:
+    import httpx
+
+    from app.core.config import settings
+    from app.core.security import create_access_token
+    from app.main import app
+
+    token = create_access_token(data={"sub": "benchmark"})
+    url = f"{settings.API_PREFIX}/detect/batch"
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(total_requests))
+
+    def build_files(index: int):
+        return [
+            ("files", (name, data, "image/jpeg"))
+            for name, data in (images[(index + i) % len(images)] for i in range(batch_size))
+        ]
+
+    async def worker(client: httpx.AsyncClient):
+        nonlocal errors
+        for index in counter:
+            start = time.perf_counter()
+            response = await client.post(url, files=build_files(index), headers={"X-Token": token})
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors += 1
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        # Warm up so model and allocator start-up costs are not counted as growth
+        await client.post(url, files=build_files(0), headers={"X-Token": token})
+        baseline_rss = _rss_bytes()
+        sampler = _PeakRss()
+        sampler.start()
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        peak_rss = sampler.stop()
+
+    return {
+        **summarize(latencies),
+        "peak_rss_bytes": peak_rss,
+        "rss_growth_bytes": peak_rss - baseline_rss,
+        "images_per_second_rps": round(total_requests * batch_size / elapsed, 3),
+        "requests": total_requests,
+        "errors": errors
+    }
+
+def _case_process(
+    images: List[Tuple[str, bytes]],
+    concurrency: int,
+    total_requests: int,
+    batch_size: int,
+    budget_mb: Optional[int],
+    batch_budget_mb: int
+) -> Dict[str, Any]:
+    # Runs in a fresh interpreter, so the settings are read with this budget
+    os.environ.pop("MEMORY_BUDGET_MB", None)
+    if budget_mb is not None:
+        os.environ["MEMORY_BUDGET_MB"] = str(budget_mb)
+        os.environ["MEMORY_BATCH_BUDGET_MB"] = str(batch_budget_mb)
+    return asyncio.run(_run_case(images, concurrency, total_requests, batch_size))
+
+def run_memory(
+    images: List[Tuple[str, bytes]],
+    concurrency: int = 16,
+    total_requests: int = 50,
+    batch_size: int = 4,
+    budget_mb: int = 256,
+    batch_budget_mb: int = 128
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Measure peak resident memory under concurrent batch uploads, with and
+    without a memory budget.
+
+    Each case runs in its own process, since memory freed by one case is
+    kept by the allocator and would hide the growth of the next.
+    """
+    results = {}
+    for name, budget in (("unbounded", None), (f"budget_{budget_mb}mb", budget_mb)):
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+            results[f"batch/concurrency_{concurrency}/{name}"] = executor.submit(
+                _case_process, images, concurrency, total_requests, batch_size, budget, batch_budget_mb
+            ).result()
+    return results
@@ -0,0 +1,126 @@
+import random
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from benchmarks.common import summarize
+
+def _measure(fn: Callable[[], Any], iterations: int, warmup: int) -> Dict[str, float]:
+    """Time a callable, discarding warmup runs"""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+def _synthetic_detections(count: int, labels: List[str], seed: int = 0) -> List[Dict[str, Any]]:
+    """Detection dicts shaped like the model service's output"""
+    rng = random.Random(seed)
+    detections = []
+    for _ in range(count):
+        xmin, ymin = rng.uniform(0, 1800), rng.uniform(0, 1000)
+        detections.append({
+            "label": rng.choice(labels),
+            "score": round(rng.random(), 4),
+            "bounding_box": {
+                "xmin": round(xmin, 2),
+                "ymin": round(ymin, 2),
+                "xmax": round(xmin + rng.uniform(10, 400), 2),
+                "ymax": round(ymin + rng.uniform(10, 400), 2)
+            }
+        })
+    return detections
+
+def run_serialization(
+    detection_counts: Tuple[int, ...] = (100, 1000),
+    iterations: int = 10,
+    warmup: int = 2
+) -> Dict[str, Dict[str, float]]:
+    """
+    Benchmark encoding responses with many detections.
+
+    "validated" is the previous path: the payload re-validated against the
+    route's response_model and encoded with the json module.
+    "orjson" and "msgpack" encode the route payload as is. Each case also
+    reports the encoded payload size.
+    """
+    from fastapi.responses import JSONResponse
+    from pydantic import TypeAdapter
+
+    from app.models.schemas import DetectionResponse
+    from app.services.model_service import model_service
+    from app.utils.serialization import FastJSONResponse, MsgPackResponse
+
+    model_service.ensure_loaded()
+    adapter = TypeAdapter(DetectionResponse)
+    labels = list(model_service.model.config.id2label.values())
+    results = {}
+    for count in detection_counts:
+        detections = _synthetic_detections(count, labels)
+        image_size = {"width": 1920, "height": 1080}
+        payload = {"success": True, "detections": detections, "processing_time": 0.0, "image_size": image_size}
+
+        cases = {
+            "validated": lambda: JSONResponse(
+                content=adapter.dump_python(adapter.validate_python(payload), mode="json")
+            ),
+            "orjson": lambda: FastJSONResponse(content=payload),
+            "msgpack": lambda: MsgPackResponse(content=payload)
+        }
+        for encoding, fn in cases.items():
+            results[f"serialize/{encoding}/detections_{count}"] = {
+                **_measure(fn, iterations, warmup),
+                "payload_bytes": len(fn().body)
+            }
+    return results
+
+def run_micro(images: List[Tuple[str, bytes]], iterations: int = 10, warmup: int = 2) -> Dict[str, Dict[str, float]]:
+    """Benchmark each pipeline stage in isolation for every image"""
+    import torch
+
+    from app.core.config import settings
+    from app.models.schemas import DetectionResponse
+    from app.services.model_service import model_service
+    from app.utils.image_processor import image_processor
+    from app.utils.serialization import FastJSONResponse
+
+    model_service.ensure_loaded()
+    results = {}
+    for name, image_bytes in images:
+        image = image_processor.convert_to_rgb(image_bytes)
+        target_sizes = torch.tensor([[image.size[1], image.size[0]]])
+        with torch.no_grad():
+            inputs = model_service.preprocess_image(image)
+            outputs = model_service.model(**inputs)
+        detections = model_service.postprocess_detections(outputs, target_sizes, 0.0)[0]
+        # Built as the detection service builds it, without validation
+        response = DetectionResponse.model_construct(
+            success=True,
+            detections=detections,
+            processing_time=0.0,
+            image_size={"width": image.size[0], "height": image.size[1]}
+        )
+
+        def decode():
+            image_processor.validate_image(image_bytes)
+            image_processor.convert_to_rgb(image_bytes)
+
+        def forward():
+            with torch.no_grad():
+                model_service.model(**inputs)
+
+        cases = {
+            "decode": decode,
+            "preprocess": lambda: model_service.preprocess_image(image),
+            "forward": forward,
+            "postprocess": lambda: model_service.postprocess_detections(
+                outputs, target_sizes, settings.DETECTION_THRESHOLD
+            ),
+            "serialize": lambda: FastJSONResponse(content=dict(response))
+        }
+        for stage, fn in cases.items():
+            results[f"{stage}/{name}"] = _measure(fn, iterations, warmup)
+    results.update(run_serialization(iterations=iterations, warmup=warmup))
+    return results